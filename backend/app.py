@@ -1,40 +1,96 @@
 # app.py
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from bson import ObjectId
 from pymongo import ReturnDocument
-import uvicorn
-import requests
-import json
+from pymongo.errors import DuplicateKeyError, PyMongoError
 import asyncio
 import os
+import time
 
 from dotenv import load_dotenv
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 PORT = os.getenv("PORT")
+# Set MONGO_TLS=0 to run against a local mongod without TLS.
+MONGO_TLS = os.getenv("MONGO_TLS", "1").lower() in ("1", "true", "yes")
+# Upper bound on users x medications in one /api/interactions/batch request.
+INTERACTION_BATCH_MAX_PAIRS = int(os.getenv("INTERACTION_BATCH_MAX_PAIRS", "500"))
 
 
-from sagemaker_client import generate_response  
-#from medication_matcher import find_closest_medications, model, get_medication_vectors_from_db
-from medication_matcher import find_closest_medications, get_medication_vectors_from_db
+from sagemaker_client import get_runtime, invocation_stats, stream_response_async
+from batching import prompt_batcher
+from medication_matcher import best_match, find_closest_medications_batch
+from catalog_cache import catalog_cache
+from fda_client import FDAError, fda_client, label_field
+from cache_utils import MISSING
+from generation_cache import age_bucket, build_shared_store, generation_cache, translation_cache_key
+from streaming import ndjson_as_completed, ndjson_response, ndjson_sections, replay, sse_response
+from instrumentation import InstrumentationMiddleware, annotate, log_sampled, render_metrics, span
+from label_compaction import LABEL_COMPACTION, compact_label, compaction_stats, format_label, load_tokenizer
+from interaction_precheck import INTERACTION_PRECHECK, PrecheckResult, get_automaton, precheck_interactions
+from user_cache import user_cache
 from user_utils import serialize_user, User, UserUpdate, MedicationUpdate
 
-app = FastAPI()
-
 # MongoDB Configuration
 DB_NAME = "medilocate"
 COLLECTION_NAME = "users"
-client = AsyncIOMotorClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+# Created once per worker by get_db() during startup. Benchmarks and checks may assign
+# db and collection beforehand to run against another database.
+client: Optional[AsyncIOMotorClient] = None
+db: Optional[AsyncIOMotorDatabase] = None
+collection = None
+
+# Reported by /api/ready.
+startup_state: Dict[str, Any] = {"warmup_done": False, "warmup_seconds": None}
+
+def get_db() -> AsyncIOMotorDatabase:
+    global client, db, collection
+    if db is None:
+        client = AsyncIOMotorClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True) if MONGO_TLS else AsyncIOMotorClient(MONGO_URI)
+        db = client[DB_NAME]
+    if collection is None:
+        collection = db[COLLECTION_NAME]
+    return db
 
-def translate_text(text: str, max_new_tokens: int = 550, top_p: float = 0.9, temperature: float = 0.6, age="20", gender="male", ispregnant=False) -> str:
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     """
-    Constructs the translation prompt and calls the SageMaker endpoint.
+    Creates the worker's clients and warms its caches before it accepts requests, so
+    the first request does not pay for building the matcher index or the boto3 client.
     """
+    started = time.perf_counter()
+    database = get_db()
+    generation_cache.shared = build_shared_store(database)
+    try:
+        # get_or_create_user relies on it to create each user exactly once.
+        await collection.create_index("email", unique=True)
+    except PyMongoError as e:
+        print("Could not create the unique email index:", e)
+    # The boto3 client and the label tokenizer are built in threads (they read from disk or
+    # download) while the catalog loads, from the CATALOG_SNAPSHOT_PATH snapshot when one is
+    # configured and the catalog has not changed, else from Mongo.
+    await asyncio.gather(asyncio.to_thread(get_runtime), asyncio.to_thread(load_tokenizer), catalog_cache.start(database))
+    if INTERACTION_PRECHECK and catalog_cache.ready:
+        await get_automaton((await catalog_cache.get()).catalog)
+    startup_state.update(warmup_done=True, warmup_seconds=round(time.perf_counter() - started, 3))
+    print(f"Worker warmed up in {startup_state['warmup_seconds']:.2f}s (catalog ready: {catalog_cache.ready})")
+    try:
+        yield
+    finally:
+        startup_state["warmup_done"] = False
+        await catalog_cache.stop()
+        await fda_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+# Per-stage timings: /metrics and a Server-Timing header on every response.
+app.add_middleware(InstrumentationMiddleware)
+
+def build_translation_prompt(text: str, age_description: str, gender: str, ispregnant: bool) -> str:
     pregnancy = "Pregnant" if ispregnant else "Not pregnant"
     system_prompt = (
         f"Please translate the following FDA information into a personalized, bullet-point list that is clear, concise, and easy-to-understand. "
@@ -42,7 +98,7 @@ def translate_text(text: str, max_new_tokens: int = 550, top_p: float = 0.9, tem
         "Include the following details: Drug Name, Ingredients, Purpose and Usage, Dosage and Administration, "
         "Adverse Ingredients (use 'ask doctor or pharmacist' if needed), and Warnings/Adverse Reactions.\n\n"
         "Now, consider the following personal information about the user to tailor your response. Especially for dosage and administration information, provide information only relevant to the patient's age.:\n"
-        f"- The user's age is {age}.\n"
+        f"- The user is {age_description}.\n"
         f"- The user's gender is {gender}.\n"
         f"- The user is {pregnancy}.\n\n"
         "If the user is under 18, advise them to consult an adult before taking any medication. "
@@ -52,14 +108,131 @@ def translate_text(text: str, max_new_tokens: int = 550, top_p: float = 0.9, tem
         "Return ONLY bullet points separated by new lines"
     )
 
+    return (
+        "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n"
+        f"{system_prompt} <|eot_id|><|start_header_id|>user<|end_header_id|>\n\n"
+        f"{text}\n"
+        "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+    )
+
+def prepare_translation(text: str, max_new_tokens: int, top_p: float, temperature: float, age, gender, ispregnant):
+    """
+    Returns the translation prompt and its generation cache key.
+    """
+    with span("prompt_build"):
+        bucket, age_description = age_bucket(age)
+        gender = str(gender).strip().lower()
+        prompt = build_translation_prompt(text, age_description, gender, ispregnant)
+        key = translation_cache_key(text, bucket, gender, ispregnant, max_new_tokens, top_p, temperature)
+    log_sampled("translation_prompt", age_bucket=bucket, gender=gender, pregnant=ispregnant)
+    return prompt, key
+
+async def translate_text(text: str, max_new_tokens: int = 550, top_p: float = 0.9, temperature: float = 0.6, age="20", gender="male", ispregnant=False, use_cache: bool = True) -> str:
+    """
+    Constructs the translation prompt and calls the SageMaker endpoint without blocking the event loop.
+
+    The prompt only depends on the label text, the user's age bucket, gender and pregnancy
+    status, so identical inputs (with identical sampling parameters) are served from the
+    generation cache unless use_cache is False.
+    """
+    prompt, key = prepare_translation(text, max_new_tokens, top_p, temperature, age, gender, ispregnant)
+    if not use_cache:
+        return await prompt_batcher.generate(prompt, max_new_tokens, top_p, temperature)
+    return await generation_cache.get_or_generate(
+        key, lambda: prompt_batcher.generate(prompt, max_new_tokens, top_p, temperature)
+    )
+
+async def stream_translation(text: str, max_new_tokens: int = 550, top_p: float = 0.9, temperature: float = 0.6, age="20", gender="male", ispregnant=False, use_cache: bool = True):
+    """
+    Streaming variant of translate_text: relays tokens as server-sent events. A cached
+    translation is replayed at once, and a completed stream populates the cache.
+    """
+    prompt, key = prepare_translation(text, max_new_tokens, top_p, temperature, age, gender, ispregnant)
+    if not use_cache:
+        return sse_response(stream_response_async(prompt, max_new_tokens, top_p, temperature))
+    cached = await generation_cache.lookup(key)
+    if cached is not MISSING:
+        return sse_response(replay(cached))
+    return sse_response(
+        stream_response_async(prompt, max_new_tokens, top_p, temperature),
+        on_complete=lambda result: generation_cache.store(key, result)
+    )
+
+async def label_text(label: dict, age, ispregnant) -> str:
+    """
+    The label sections sent to the translation prompt, compacted for this user to
+    LABEL_TOKEN_BUDGET tokens unless LABEL_COMPACTION is off.
+    """
+    if not LABEL_COMPACTION:
+        return format_label(label)
+    with span("label_compaction"):
+        # Tokenizing is CPU-bound (and may load the tokenizer); keep it off the event loop.
+        compacted = await asyncio.to_thread(compact_label, label, age_bucket(age)[0], bool(ispregnant))
+    annotate("label_tokens", f"{compacted.original_tokens} -> {compacted.tokens}")
+    log_sampled("label_compaction", original_tokens=compacted.original_tokens, tokens=compacted.tokens, tokens_saved=compacted.tokens_saved)
+    return compacted.text
+
+async def precheck_label(interaction_text: str, current_medications: List[str]) -> PrecheckResult:
+    medication_index = await catalog_cache.get()
+    automaton = await get_automaton(medication_index.catalog)
+    with span("precheck"):
+        return precheck_interactions(interaction_text, current_medications, automaton, medication_index.catalog.ingredients)
+
+async def interaction_inputs(current_medications: List[str], label: Optional[dict], precheck: bool = True) -> Optional[Tuple[List[str], str]]:
+    """
+    The medications and FDA interaction text to send to the LLM, or None when there is
+    nothing to check: the label has no interaction text, the user takes no medications
+    or, with INTERACTION_PRECHECK on, the precheck finds none of them in the text.
+    """
+    interaction_text = label_field(label, "drug_interactions") if label else ""
+    if not interaction_text or not current_medications:
+        return None
+
+    if precheck and INTERACTION_PRECHECK:
+        # Opt-in: skip the LLM when no medication is named in the label, and only send the
+        # sentences naming them. Interactions stated by drug class ("NSAIDs") are missed.
+        matches = await precheck_label(interaction_text, current_medications)
+        if not matches.matched_medications:
+            return None
+        return matches.matched_medications, " ".join(matches.sentences)
+    return current_medications, interaction_text
+
+async def build_interaction_prompt(current_medications: List[str], medication: str, label: Optional[dict], precheck: bool = True) -> Optional[str]:
+    """
+    Builds the interaction prompt from the FDA interaction label, or returns None when
+    there is nothing to check (see interaction_inputs).
+    """
+    inputs = await interaction_inputs(current_medications, label, precheck)
+    if inputs is None:
+        return None
+    medications, interaction_text = inputs
+    with span("prompt_build"):
+        return interaction_prompt(medications, medication, interaction_text)
+
+def interaction_prompt(current_medications: List[str], medication: str, interaction_text: str) -> str:
+    if not interaction_text:
+        interaction_text = "No interaction information available."
+    system_prompt = (
+        "User is seeking to start taking a new medication, but want to make sure there are no adverse interactions with the current medications. I will provide you a list of medications a user is currently taking. "
+        "Based on this list of current medication and the FDA's data on the substances that interact with the new medication, please make inferences of whether every medication on the list interacts with the new medication"
+        "If any of the current medication is known to have adverse interaction with the new medication, please generate a bullet point consisted of what that current medication is, and a concise explanation of why it is (paraphrase the FDA text)"
+        "If no significant interactions found or the using is not taking any medications, do not say anything."
+        "Return only the bullet points separated by new lines, with no additional text."
+    )
+    text = (
+        ""
+        f"User is currently taking: {', '.join(current_medications) if current_medications else 'None'}.\n"
+        f"New medication to be added: {medication}.\n"
+        f"FDA interaction information for the new medication: {interaction_text}\n\n"
+        "Based on the above information, list any potential drug interactions that the user should be aware of. "
+    )
     prompt = (
         "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n"
         f"{system_prompt} <|eot_id|><|start_header_id|>user<|end_header_id|>\n\n"
         f"{text}\n"
         "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
     )
-    print(age, gender, ispregnant)
-    return generate_response(prompt, max_new_tokens, top_p, temperature)
+    return prompt
 
 class CombinedMedicationResponse(BaseModel):
     results: List[str]
@@ -71,8 +244,18 @@ async def get_medications(
 ):
     if not query:
         raise HTTPException(status_code=400, detail="Query parameter is required")
+    return CombinedMedicationResponse(
+        results = await match_medications(query, k)
+    )
+
+def prefix_queries(query: str) -> List[str]:
+    """
+    The first one, two and three words of the OCR text.
+    """
     let_keywords = [word.strip() for word in query.split(' ') if word.strip()]
-    
+    if not let_keywords:
+        return []
+
     while len(let_keywords) < 3:
         let_keywords.append(let_keywords[-1])
     
@@ -80,21 +263,25 @@ async def get_medications(
     q1 = let_keywords[0]
     q2 = " ".join(let_keywords[:2])
     q3 = " ".join(let_keywords[:3])
-    print(q1, q2, q3)
-    
-    # Retrieve medication names from the "medications" collection (cached)
-    medication_vectors = await get_medication_vectors_from_db(db)
-    result1, result2, result3 = await asyncio.gather(
-        asyncio.to_thread(find_closest_medications, q1, medication_vectors, k+2),
-        asyncio.to_thread(find_closest_medications, q2, medication_vectors, k+1),
-        asyncio.to_thread(find_closest_medications, q3, medication_vectors, k)
-    )
-    combined_results = result1+result2+result3
-    print(combined_results)
-    unique_results = list(dict.fromkeys(combined_results))
-    return CombinedMedicationResponse(
-        results = unique_results
-    )
+    return [q1, q2, q3]
+
+async def match_medications(query: str, k: int) -> List[str]:
+    queries = prefix_queries(query)
+    if not queries:
+        return []
+    q1, q2, q3 = queries
+
+    # Current n-gram index over the "medications" collection (refreshed in the background)
+    medication_index = await catalog_cache.get()
+    # One pass over the catalog for all three prefixes, merged and deduplicated
+    with span("match"):
+        unique_results = await asyncio.to_thread(
+            find_closest_medications_batch,
+            [(q1, k+2), (q2, k+1), (q3, k)],
+            medication_index
+        )
+    log_sampled("match", queries=[q1, q2, q3], results=unique_results)
+    return unique_results
 
 @app.get("/api/fda_translate")
 async def fda_translate(
@@ -102,52 +289,35 @@ async def fda_translate(
         medication: str = Query(..., description="Medication name to query FDA API"),
         max_new_tokens: int = Query(256, description="Max tokens for translation"),
         top_p: float = Query(0.9, description="Top p for translation"),
-        temperature: float = Query(0.6, description="Temperature for translation")):
-    # Query FDA API using openFDA's drug label endpoint.
-    fda_url = f"https://api.fda.gov/drug/label.json?search=openfda.brand_name:{medication}&limit=1"
-    # retrieve user from MongoDB
-    user = await db['users'].find_one({"_id": ObjectId(user_id)})
+        temperature: float = Query(0.6, description="Temperature for translation"),
+        cache: bool = Query(True, description="Reuse a cached translation for the same label, demographic and parameters; set to false for a fresh sample"),
+        stream: bool = Query(False, description="Stream tokens as server-sent events instead of returning the full response")):
+    # retrieve the user's profile (cached briefly across the endpoints of a scan)
+    user = await user_cache.get(collection, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user_age = user.get("age", "20")
     user_gender = user.get("gender", "male")
     is_pregnant = user.get("pregnant", False)
 
+    # Query FDA API using openFDA's drug label endpoint (pooled, cached).
     try:
-        fda_response = requests.get(fda_url)
-        fda_response.raise_for_status()
-    except Exception as e:
+        result = await fda_client.label_by_brand_name(medication)
+    except FDAError as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch FDA data: {str(e)}")
-    
-    data = fda_response.json()
-    if "results" not in data or len(data["results"]) == 0:
+    if result is None:
         raise HTTPException(status_code=404, detail="No FDA data found for the provided medication")
+
+    combined_text = await label_text(result, user_age, is_pregnant)
     
-    result = data["results"][0]
-    
-    def extract_field(key: str):
-        value = result.get(key, "")
-        if isinstance(value, list):
-            return " ".join(value)
-        return value
-
-    combined_text = (
-        f"Purpose: {extract_field('purpose')}\n"
-        f"Indication and Usage: {extract_field('indication_and_usage')}\n"
-        f"Active Ingredient: {extract_field('active_ingredient')}\n"
-        f"Do not use: {extract_field('do_not_use')}\n"
-        f"Warnings: {extract_field('warnings')}\n"
-        f"Instruction For Use: {extract_field('instruction_for_use')}\n"
-        f"Drug Interactions: {extract_field('drug_interactions')}"
-        f"Dosage: {extract_field('dosage_and_administration')}"
-        f"Pregnancy or Breastfeeding: {extract_field('pregnancy_or_breast_feeding')}"
-        f"Ask Doctor: {extract_field('ask_doctor')}"
-        f"Ask Doctor or Pharmacist: {extract_field('ask_doctor_or_pharmacist')}"
-    )
-    
+    if stream:
+        return await stream_translation(combined_text, max_new_tokens, top_p, temperature, user_age, user_gender, is_pregnant, use_cache=cache)
+
     try:
-        translation_result = translate_text(combined_text, max_new_tokens, top_p, temperature, user_age, user_gender, is_pregnant)
+        translation_result = await translate_text(combined_text, max_new_tokens, top_p, temperature, user_age, user_gender, is_pregnant, use_cache=cache)
         return translation_result
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out generating translation")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate translation: {str(e)}")
 
@@ -157,80 +327,255 @@ async def get_interactions(
     medication: str = Query(..., description="New medication to check for interactions"),
     max_new_tokens: int = Query(256, description="Max tokens for LLM response"),
     top_p: float = Query(0.9, description="Top p for LLM response"),
-    temperature: float = Query(0.6, description="Temperature for LLM response")
+    temperature: float = Query(0.6, description="Temperature for LLM response"),
+    stream: bool = Query(False, description="Stream tokens as server-sent events instead of returning the full response"),
+    precheck: bool = Query(True, description="With INTERACTION_PRECHECK on, return no interactions without calling the LLM when none of the user's medications are named in the FDA interaction text")
 ):
-    # retrieve user from MongoDB
-    user = await db['users'].find_one({"_id": ObjectId(user_id)})
+    # retrieve the user's profile (cached briefly across the endpoints of a scan)
+    user = await user_cache.get(collection, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     current_medications = user.get("medications", [])
     
-    fda_url = f"https://api.fda.gov/drug/label.json?search=drug_interactions:{medication}&limit=1"
-    found_response = True
     try:
-        fda_response = requests.get(fda_url)
-        fda_response.raise_for_status()
-    except Exception as e:
-        found_response = False
+        result = await fda_client.interaction_label(medication)
+    except FDAError:
+        result = None
+
+    prompt = await build_interaction_prompt(current_medications, medication, result, precheck)
+    if prompt is None:
+        no_interactions = {"generated_text": ""}
+        return sse_response(replay(no_interactions)) if stream else no_interactions
+    if stream:
+        return sse_response(stream_response_async(prompt, max_new_tokens, top_p, temperature))
 
-    if found_response:
-        data = fda_response.json()
-    if found_response == False or "results" not in data or len(data["results"]) == 0:
-        interaction_text = "No interaction information available."
-    else:
-        result = data["results"][0]
-
-        def extract_field(key: str):
-            value = result.get(key, "")
-            if isinstance(value, list):
-                return " ".join(value)
-            return value
-        interaction_text = extract_field("drug_interactions")
-        if not interaction_text:
-            interaction_text = "No interaction information available."
-    system_prompt = (
-        "User is seeking to start taking a new medication, but want to make sure there are no adverse interactions with the current medications. I will provide you a list of medications a user is currently taking. "
-        "Based on this list of current medication and the FDA's data on the substances that interact with the new medication, please make inferences of whether every medication on the list interacts with the new medication"
-        "If any of the current medication is known to have adverse interaction with the new medication, please generate a bullet point consisted of what that current medication is, and a concise explanation of why it is (paraphrase the FDA text)"
-        "If no significant interactions found or the using is not taking any medications, do not say anything."
-        "Return only the bullet points separated by new lines, with no additional text."
-    )
-    text = (
-        ""
-        f"User is currently taking: {', '.join(current_medications) if current_medications else 'None'}.\n"
-        f"New medication to be added: {medication}.\n"
-        f"FDA interaction information for the new medication: {interaction_text}\n\n"
-        "Based on the above information, list any potential drug interactions that the user should be aware of. "
-    )
-    prompt = (
-        "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n"
-        f"{system_prompt} <|eot_id|><|start_header_id|>user<|end_header_id|>\n\n"
-        f"{text}\n"
-        "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
-    )
-    
     try:
-        llm_output = generate_response(prompt, max_new_tokens, top_p, temperature)
+        llm_output = await prompt_batcher.generate(prompt, max_new_tokens, top_p, temperature)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out generating LLM response")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate LLM response: {str(e)}")
     
     return llm_output
 
+class InteractionBatch(BaseModel):
+    user_id: Optional[str] = None
+    user_ids: List[str] = []
+    medications: List[str]
+    max_new_tokens: int = 256
+    top_p: float = 0.9
+    temperature: float = 0.6
+    precheck: bool = True
+
+async def batch_interaction(
+    current_medications: List[str], medication: str, label: Awaitable[Optional[dict]],
+    generations: Dict[str, asyncio.Future], batch: InteractionBatch
+) -> dict:
+    """
+    Checks one user's medications against one new medication, with the same rule as
+    /api/interactions for when the LLM is called (interaction_inputs). "hits" are the
+    medications sent to it, and identical prompts share a generation.
+    """
+    no_interactions = {"checked": current_medications, "hits": [], "generated_text": ""}
+    if not current_medications:
+        return no_interactions
+    try:
+        interaction_label = await label
+    except FDAError:
+        interaction_label = None
+    inputs = await interaction_inputs(current_medications, interaction_label, batch.precheck)
+    if inputs is None:
+        return no_interactions
+    hits, interaction_text = inputs
+
+    with span("prompt_build"):
+        prompt = interaction_prompt(hits, medication, interaction_text)
+    generation = generations.get(prompt)
+    if generation is None:
+        generation = generations[prompt] = asyncio.ensure_future(
+            prompt_batcher.generate(prompt, batch.max_new_tokens, batch.top_p, batch.temperature)
+        )
+    # Shielded: other pairs may be waiting on the same generation.
+    return {"checked": current_medications, "hits": hits, **await scan_section(asyncio.shield(generation))}
+
+async def batch_pair(user_id: str, medication: str, check: Awaitable[dict]) -> dict:
+    return {"user_id": user_id, "medication": medication, **await scan_section(check)}
+
+async def batch_interaction_lines(ready: List[dict], pending: List[Awaitable[dict]], shared: Callable[[], List[asyncio.Future]]):
+    try:
+        async for line in ndjson_as_completed(ready, pending):
+            yield line
+    finally:
+        # Label fetches and generations outlive single pairs; stop them with the stream.
+        for future in shared():
+            future.cancel()
+
+@app.post("/api/interactions/batch")
+async def get_batch_interactions(batch: InteractionBatch):
+    """
+    /api/interactions for several new medications and one or more users. Each label is
+    fetched once for all users (and, with INTERACTION_PRECHECK on, every user's medications
+    are prechecked against it), and one NDJSON line per (user, medication) is streamed as
+    soon as that pair is done.
+    """
+    user_ids = list(dict.fromkeys(([batch.user_id] if batch.user_id else []) + batch.user_ids))
+    medications = list(dict.fromkeys(name.strip() for name in batch.medications if name.strip()))
+    if not user_ids or not medications:
+        raise HTTPException(status_code=400, detail="At least one user and one medication are required")
+    if len(user_ids) * len(medications) > INTERACTION_BATCH_MAX_PAIRS:
+        raise HTTPException(status_code=400, detail=f"At most {INTERACTION_BATCH_MAX_PAIRS} user and medication pairs per request")
+
+    valid_ids = [user_id for user_id in user_ids if ObjectId.is_valid(user_id)]
+    users = await user_cache.get_many(collection, valid_ids)
+    ready = [{"user_id": user_id, "error": "User not found"} for user_id in user_ids if users.get(user_id) is None]
+    labels = {medication: asyncio.ensure_future(fda_client.interaction_label(medication)) for medication in medications}
+    generations: Dict[str, asyncio.Future] = {}
+    pending = [
+        batch_pair(user_id, medication, batch_interaction(list(user.get("medications", [])), medication, asyncio.shield(label), generations, batch))
+        for user_id, user in users.items() if user is not None
+        for medication, label in labels.items()
+    ]
+    log_sampled("interaction_batch", users=len(user_ids), medications=len(medications), pairs=len(pending))
 
-# User-related endpoints remain unchanged
+    def shared_futures():
+        return [*labels.values(), *generations.values()]
+
+    return ndjson_response(batch_interaction_lines(ready, pending, shared_futures))
+
+async def scan_translation(user: dict, medication: str, max_new_tokens: int, top_p: float, temperature: float, use_cache: bool) -> dict:
+    label = await fda_client.label_by_brand_name(medication)
+    if label is None:
+        raise HTTPException(status_code=404, detail="No FDA data found for the provided medication")
+    return await translate_text(
+        await label_text(label, user.get("age", "20"), user.get("pregnant", False)), max_new_tokens, top_p, temperature,
+        user.get("age", "20"), user.get("gender", "male"), user.get("pregnant", False), use_cache=use_cache
+    )
+
+async def scan_interactions(user: dict, medication: str, max_new_tokens: int, top_p: float, temperature: float, precheck: bool) -> dict:
+    try:
+        label = await fda_client.interaction_label(medication)
+    except FDAError:
+        label = None
+    prompt = await build_interaction_prompt(user.get("medications", []), medication, label, precheck)
+    if prompt is None:
+        return {"generated_text": ""}
+    return await prompt_batcher.generate(prompt, max_new_tokens, top_p, temperature)
+
+async def scan_section(section: Awaitable[dict]) -> dict:
+    """
+    Runs one section of a scan; a failure becomes {"error": ...} instead of failing the scan.
+    """
+    try:
+        return await section
+    except HTTPException as e:
+        return {"error": e.detail}
+    except FDAError as e:
+        return {"error": f"Failed to fetch FDA data: {str(e)}"}
+    except asyncio.TimeoutError:
+        return {"error": "Timed out generating LLM response"}
+    except Exception as e:
+        return {"error": f"Failed to generate LLM response: {str(e)}"}
+
+@app.get("/api/scan")
+async def scan_medication(
+    user_id: str = Query(..., description="User ID for the current user"),
+    query: str = Query(..., description="Raw OCR text of the scanned package"),
+    k: int = Query(1, description="Number of nearest neighbors to return for each inference", gt=0),
+    max_new_tokens: int = Query(256, description="Max tokens for each LLM response"),
+    top_p: float = Query(0.9, description="Top p for LLM responses"),
+    temperature: float = Query(0.6, description="Temperature for LLM responses"),
+    cache: bool = Query(True, description="Reuse a cached translation for the same label, demographic and parameters"),
+    precheck: bool = Query(True, description="With INTERACTION_PRECHECK on, skip the interaction LLM call when none of the user's medications are named in the FDA interaction text"),
+    stream: bool = Query(False, description="Stream one NDJSON line per section (match, translation, interactions) as soon as it is ready")
+):
+    """
+    /api/medications, /api/fda_translate and /api/interactions in one call: the OCR text is
+    resolved to its best match, then both FDA lookups and both LLM generations run
+    concurrently, so the scan takes about as long as the slower generation.
+    """
+    user, candidates = await asyncio.gather(user_cache.get(collection, user_id), match_medications(query, k))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not candidates:
+        raise HTTPException(status_code=404, detail="No matching medication found")
+    # Candidates come in query order (all of the first word's matches first), so pick the
+    # one closest to the whole OCR text or one of its prefixes: "Advil PM", not "Advil".
+    medication = best_match([" ".join(query.split()), *prefix_queries(query)], candidates)
+
+    match = {"medication": medication, "candidates": candidates}
+    sections = {
+        "translation": scan_section(scan_translation(user, medication, max_new_tokens, top_p, temperature, cache)),
+        "interactions": scan_section(scan_interactions(user, medication, max_new_tokens, top_p, temperature, precheck)),
+    }
+    if stream:
+        return ndjson_response(ndjson_sections({"match": match}, sections))
+    results = await asyncio.gather(*sections.values())
+    return {**match, **dict(zip(sections, results))}
+
+@app.get("/api/ready", response_model=dict)
+async def get_ready():
+    # 503 until warmup is done and a catalog index is loaded (load balancer readiness probe).
+    ready = startup_state["warmup_done"] and catalog_cache.ready
+    body = {"ready": ready, **startup_state, "catalog_from_snapshot": catalog_cache.metrics["snapshot_loaded"]}
+    return body if ready else JSONResponse(status_code=503, content=body)
+
+@app.get("/api/catalog/status", response_model=dict)
+async def get_catalog_status():
+    return catalog_cache.metrics
+
+@app.get("/api/fda/status", response_model=dict)
+async def get_fda_status():
+    return fda_client.stats()
+
+@app.get("/api/user_cache/status", response_model=dict)
+async def get_user_cache_status():
+    return user_cache.stats()
+
+@app.get("/api/llm/status", response_model=dict)
+async def get_llm_status():
+    return {**invocation_stats(), "batching": prompt_batcher.stats(), "translation_cache": generation_cache.stats(), "label_compaction": compaction_stats}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Request and stage latency histograms, plus the counters of the status endpoints as gauges.
+    return PlainTextResponse(render_metrics({
+        "catalog": catalog_cache.metrics,
+        "fda": fda_client.stats(),
+        "user_cache": user_cache.stats(),
+        "llm": invocation_stats(),
+        "llm_batching": prompt_batcher.stats(),
+        "translation_cache": generation_cache.stats(),
+        "label_compaction": compaction_stats,
+    }), media_type="text/plain; version=0.0.4")
+
+# Each user endpoint is a single atomic operation (one round trip).
 @app.post("/api/users", response_model=dict)
 async def get_or_create_user(user: User):
-    existing_user = await collection.find_one({"email": user.email})
+    new_user = {"_id": ObjectId(), **user.dict()}
+    # Upsert on the unique email index: returns the existing user, or None when
+    # new_user was inserted. Two concurrent creates can both try to insert; the
+    # loser gets a DuplicateKeyError and its retry finds the winner's document.
+    for attempt in range(2):
+        try:
+            with span("mongo_user_upsert"):
+                existing_user = await collection.find_one_and_update(
+                    {"email": user.email},
+                    {"$setOnInsert": new_user},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+            break
+        except DuplicateKeyError:
+            if attempt:
+                raise
     if existing_user:
         return {"user": serialize_user(existing_user), "message": "User already exists"}
-    
-    new_user = await collection.insert_one(user.dict())
-    created_user = await collection.find_one({"_id": new_user.inserted_id})
-    return {"user": serialize_user(created_user), "message": "User created successfully"}
+    return {"user": serialize_user(new_user), "message": "User created successfully"}
 
 @app.get("/api/users/{id}", response_model=dict)
 async def get_user_by_id(id: str):
-    user = await collection.find_one({"_id": ObjectId(id)})
+    with span("mongo_user_lookup"):
+        user = await collection.find_one({"_id": ObjectId(id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return serialize_user(user)
@@ -238,39 +583,60 @@ async def get_user_by_id(id: str):
 @app.put("/api/users/{id}", response_model=dict)
 async def update_user(id: str, updates: UserUpdate):
     update_data = {k: v for k, v in updates.dict(exclude_unset=True).items()}
-    updated_user = await collection.find_one_and_update(
-        {"_id": ObjectId(id)},
-        {"$set": update_data},
-        return_document=ReturnDocument.AFTER
-    )
+    with span("mongo_user_update"):
+        updated_user = await collection.find_one_and_update(
+            {"_id": ObjectId(id)},
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+    user_cache.invalidate(id)
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"user": serialize_user(updated_user), "message": "User updated successfully"}
 
 @app.delete("/api/users/{id}", response_model=dict)
 async def delete_user(id: str):
-    user = await collection.find_one({"_id": ObjectId(id)})
+    with span("mongo_user_delete"):
+        user = await collection.find_one_and_delete({"_id": ObjectId(id)}, projection={"_id": 1})
+    user_cache.invalidate(id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    await collection.delete_one({"_id": ObjectId(id)})
     return {"message": "User deleted successfully"}
 
 @app.patch("/api/users/{id}/medications", response_model=dict)
 async def update_medications(id: str, medication_update: MedicationUpdate):
-    user = await collection.find_one({"_id": ObjectId(id)})
-    if not user:
+    to_add = list(dict.fromkeys(medication_update.medicationsToAdd or []))
+    to_remove = list(dict.fromkeys(medication_update.medicationsToRemove or []))
+    # The set arithmetic runs on the server, so concurrent edits are not lost.
+    if to_add and to_remove:
+        # $addToSet and $pull cannot target the same field in one update; remove
+        # then add in an update pipeline instead ($literal: names are not field paths).
+        update = [{"$set": {"medications": {"$setUnion": [
+            {"$setDifference": [{"$ifNull": ["$medications", []]}, {"$literal": to_remove}]},
+            {"$literal": to_add},
+        ]}}}]
+    elif to_add:
+        update = {"$addToSet": {"medications": {"$each": to_add}}}
+    elif to_remove:
+        update = {"$pull": {"medications": {"$in": to_remove}}}
+    else:
+        update = None
+
+    if update is None:
+        with span("mongo_user_lookup"):
+            updated_user = await collection.find_one({"_id": ObjectId(id)})
+    else:
+        with span("mongo_user_update"):
+            updated_user = await collection.find_one_and_update(
+                {"_id": ObjectId(id)},
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+        user_cache.invalidate(id)
+    if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    current_medications = set(user.get("medications", []))
-    current_medications.difference_update(medication_update.medicationsToRemove)
-    current_medications.update(medication_update.medicationsToAdd)
-    
-    updated_user = await collection.find_one_and_update(
-        {"_id": ObjectId(id)},
-        {"$set": {"medications": list(current_medications)}},
-        return_document=ReturnDocument.AFTER
-    )
     return {"user": serialize_user(updated_user), "message": "Medications updated successfully"}
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=PORT, reload=True)
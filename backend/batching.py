@@ -0,0 +1,85 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Tuple
+
+from config import SAGEMAKER_TIMEOUT_SECONDS
+from sagemaker_client import generate_batch_async, generate_response_async
+
+# Max prompts per batched invocation. 1 disables batching: TGI containers only accept a
+# single prompt per request, LMI/DJL containers accept a list of inputs.
+SAGEMAKER_BATCH_MAX_SIZE = int(os.getenv("SAGEMAKER_BATCH_MAX_SIZE", "1"))
+# How long the first prompt of a batch waits for others to join.
+SAGEMAKER_BATCH_WINDOW_MS = float(os.getenv("SAGEMAKER_BATCH_WINDOW_MS", "10"))
+
+_ParamsKey = Tuple[int, float, float]
+
+
+class PromptBatcher:
+    """
+    Collects prompts that arrive within a short window and sends them to the endpoint as
+    one batched invocation, then fans the results back out to the waiting callers.
+    Only prompts with identical sampling parameters share a batch.
+    """
+
+    def __init__(self, max_batch_size: int = SAGEMAKER_BATCH_MAX_SIZE, window_ms: float = SAGEMAKER_BATCH_WINDOW_MS):
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self._pending: Dict[_ParamsKey, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[_ParamsKey, asyncio.TimerHandle] = {}
+        self.batches = 0
+        self.batched_prompts = 0
+
+    async def generate(self, prompt: str, max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6, timeout: float = SAGEMAKER_TIMEOUT_SECONDS) -> Any:
+        if self.max_batch_size <= 1:
+            return await generate_response_async(prompt, max_new_tokens, top_p, temperature, timeout)
+        loop = asyncio.get_running_loop()
+        key = (max_new_tokens, top_p, temperature)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((prompt, future))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        # The batch keeps running if this caller times out or goes away.
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def _flush(self, key: _ParamsKey):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key: _ParamsKey, batch: List[Tuple[str, asyncio.Future]]):
+        max_new_tokens, top_p, temperature = key
+        prompts = [prompt for prompt, _ in batch]
+        self.batches += 1
+        self.batched_prompts += len(prompts)
+        try:
+            if len(prompts) == 1:
+                results = [await generate_response_async(prompts[0], max_new_tokens, top_p, temperature)]
+            else:
+                results = await generate_batch_async(prompts, max_new_tokens, top_p, temperature)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                # Mark the exception as retrieved even if the caller already gave up.
+                future.exception()
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1000.0,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_prompts / self.batches, 2) if self.batches else None,
+        }
+
+
+prompt_batcher = PromptBatcher()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark of the API with local stand-ins: a synthetic catalog in
+mongomock (or a local mongod), the stub openFDA server and the fake SageMaker runtime.
+
+    python bench/bench_app.py --catalog-size 50000 --concurrency 1 8 32 --json results.json
+    python bench/bench_app.py --mongo-uri mongodb://localhost:27017 --compare results.json
+
+Requests go through the ASGI app in-process (httpx.ASGITransport), so the numbers
+include routing, validation and serialization but no network. Each run records the
+current commit so result files from different commits can be compared with --compare.
+Without --mongo-uri the harness needs mongomock (pip install mongomock).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import AsyncMongomockDatabase, FDAStubServer, synthetic_names
+
+SCENARIOS = [
+    "medications",
+    "fda_translate",
+    "interactions",
+    "interactions_batch",
+    "scan",
+    "users_get",
+    "users_create",
+    "users_update_medications",
+    "users_delete",
+]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ocr_text(rng, names):
+    # OCR output looks like the name followed by some package text.
+    return f"{rng.choice(names).upper()} {rng.choice(['TABLETS', 'CAPLETS', '200 mg', 'Pain Reliever'])}"
+
+
+def seed_database(sync_db, names, users, rng):
+    sync_db["medications"].delete_many({})
+    sync_db["users"].delete_many({})
+    sync_db["medications"].insert_many([{"name": name} for name in names], ordered=False)
+    sync_db["catalog_meta"].update_one({"_id": "medications"}, {"$inc": {"version": 1}}, upsert=True)
+    result = sync_db["users"].insert_many([
+        {
+            "name": f"Bench User {i}",
+            "email": f"bench-{i}@example.com",
+            "medications": rng.sample(names, 3),
+            "gender": rng.choice(["male", "female"]),
+            "age": str(rng.randint(5, 90)),
+            "pregnant": False,
+        }
+        for i in range(users)
+    ])
+    return [str(user_id) for user_id in result.inserted_ids]
+
+
+def request_factory(scenario, args, names, user_ids, rng):
+    """
+    Returns an async function issuing one request of the scenario with an httpx client.
+    """
+    cache = "true" if args.llm_cache else "false"
+    created = []
+
+    if scenario == "medications":
+        return lambda client: client.get("/api/medications", params={"query": ocr_text(rng, names)})
+    if scenario == "fda_translate":
+        return lambda client: client.get("/api/fda_translate", params={"user_id": rng.choice(user_ids), "medication": rng.choice(names), "cache": cache})
+    if scenario == "interactions":
+        return lambda client: client.get("/api/interactions", params={"user_id": rng.choice(user_ids), "medication": rng.choice(names)})
+    if scenario == "interactions_batch":
+        async def batch(client):
+            # Reads the whole NDJSON stream, so the latency is that of the slowest pair.
+            return await client.post("/api/interactions/batch", json={"user_id": rng.choice(user_ids), "medications": rng.sample(names, 5)})
+        return batch
+    if scenario == "scan":
+        return lambda client: client.get("/api/scan", params={"user_id": rng.choice(user_ids), "query": ocr_text(rng, names), "cache": cache})
+    if scenario == "users_get":
+        return lambda client: client.get(f"/api/users/{rng.choice(user_ids)}")
+    if scenario == "users_update_medications":
+        return lambda client: client.patch(f"/api/users/{rng.choice(user_ids)}/medications", json={"medicationsToAdd": [rng.choice(names)]})
+    if scenario in ("users_create", "users_delete"):
+        async def create(client):
+            response = await client.post("/api/users", json={
+                "name": "Bench User", "email": f"bench-{time.monotonic_ns()}-{rng.random()}@example.com",
+                "medications": [], "gender": "female", "age": "30", "pregnant": False,
+            })
+            created.append(response.json()["user"]["id"])
+            return response
+        if scenario == "users_create":
+            return create
+
+        async def delete(client):
+            # Users are created as part of the request being timed only when the pool runs dry.
+            if not created:
+                await create(client)
+            return await client.delete(f"/api/users/{created.pop()}")
+        delete.prepare = create
+        return delete
+    raise ValueError(scenario)
+
+
+async def run(client, send, requests, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in counter:
+            started = time.perf_counter()
+            try:
+                response = await send(client)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": errors,
+    }
+
+
+async def bench(args, app_module, names, user_ids):
+    import httpx
+
+    rng = random.Random(args.seed)
+    results = []
+    transport = httpx.ASGITransport(app=app_module.app)
+    print(f"{'scenario':>26} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6}")
+    # The lifespan starts the catalog cache (warmed from the seeded collection).
+    async with app_module.app.router.lifespan_context(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    send = request_factory(scenario, args, names, user_ids, rng)
+                    if hasattr(send, "prepare"):
+                        for _ in range(args.requests + args.warmup):
+                            await send.prepare(client)
+                    # A few untimed requests so first-call costs are not measured.
+                    for _ in range(min(args.warmup, args.requests)):
+                        await send(client)
+                    result = await run(client, send, args.requests, concurrency)
+                    result.update(scenario=scenario, concurrency=concurrency, requests=args.requests)
+                    results.append(result)
+                    print(f"{scenario:>26} {concurrency:>5} {result['throughput_rps']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} {result['errors']:>6}")
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    print(f"{'scenario':>26} {'conc':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}")
+    for result in results:
+        old = previous.get((result["scenario"], result["concurrency"]))
+        if old is None:
+            continue
+
+        def change(key):
+            return f"{(result[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "n/a"
+
+        print(f"{result['scenario']:>26} {result['concurrency']:>5} {change('p50_ms'):>9} {change('p95_ms'):>9} {change('p99_ms'):>9} {change('throughput_rps'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--catalog-size", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--mongo-uri", help="Use this (local) mongod instead of mongomock; data goes to the medilocate_bench database")
+    parser.add_argument("--fda-latency", type=float, default=0.05, help="Stub openFDA latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake SageMaker latency (s)")
+    parser.add_argument("--llm-cache", action="store_true", help="Let the translation cache serve repeated labels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Results file of a previous run to compare with")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = synthetic_names(args.catalog_size, args.seed)
+    fda_stub = FDAStubServer(names, latency=args.fda_latency, seed=args.seed).start()
+
+    # The app reads these at import time.
+    os.environ.update(
+        OPENFDA_BASE_URL=fda_stub.url,
+        SAGEMAKER_FAKE="1",
+        SAGEMAKER_FAKE_LATENCY=str(args.llm_latency),
+        MONGO_URI=args.mongo_uri or "mongodb://localhost:27017",
+        MONGO_TLS="0",
+        # A snapshot of another run's synthetic catalog would be picked up at startup.
+        CATALOG_SNAPSHOT_PATH="",
+    )
+    import app as app_module
+
+    if args.mongo_uri:
+        import pymongo
+        from motor.motor_asyncio import AsyncIOMotorClient
+        sync_db = pymongo.MongoClient(args.mongo_uri)["medilocate_bench"]
+        db = AsyncIOMotorClient(args.mongo_uri)["medilocate_bench"]
+    else:
+        db = AsyncMongomockDatabase()
+        sync_db = db.sync
+    user_ids = seed_database(sync_db, names, args.users, rng)
+    app_module.db = db
+    app_module.collection = db["users"]
+
+    try:
+        results = asyncio.run(bench(args, app_module, names, user_ids))
+    finally:
+        fda_stub.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": current_commit(), "args": vars(args), "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
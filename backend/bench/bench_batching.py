@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency of the LLM path with and without micro-batching, against the
+in-process fake SageMaker endpoint.
+
+    python bench/bench_batching.py --requests 200 --concurrency 1 8 32 64 --batch-sizes 1 4 8
+
+The fake models a single instance (--capacity concurrent requests) whose latency grows
+by --batch-item-latency for every extra prompt in a batch.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SAGEMAKER_FAKE", "1")
+
+import sagemaker_client
+from batching import PromptBatcher
+from sagemaker_fake import FakeSageMakerRuntime
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run(batcher: PromptBatcher, requests: int, concurrency: int):
+    latencies = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            await batcher.generate(f"prompt {i}", 64, 0.9, 0.6)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_batch_size": batcher.stats()["mean_batch_size"],
+    }
+
+
+async def sweep(args):
+    # One event loop for the whole sweep: the client's in-flight semaphore is bound to it.
+    results = []
+    print(f"{'batch':>5} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>10}")
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            batcher = PromptBatcher(max_batch_size=batch_size, window_ms=args.window_ms)
+            result = await run(batcher, args.requests, concurrency)
+            result.update(batch_size=batch_size, concurrency=concurrency)
+            results.append(result)
+            print(f"{batch_size:>5} {concurrency:>5} {result['throughput_rps']:>8} {result['p50_ms']:>8} {result['p99_ms']:>8} {str(result['mean_batch_size']):>10}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--window-ms", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake endpoint latency for one prompt (s)")
+    parser.add_argument("--batch-item-latency", type=float, default=0.02, help="Extra latency per additional prompt in a batch (s)")
+    parser.add_argument("--capacity", type=int, default=2, help="Requests the fake endpoint serves concurrently")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    sagemaker_client.set_runtime(FakeSageMakerRuntime(
+        latency=args.latency, batch_item_latency=args.batch_item_latency, capacity=args.capacity
+    ))
+    results = asyncio.run(sweep(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
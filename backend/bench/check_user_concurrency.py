@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for the user endpoints against a local mongod.
+
+Runs many concurrent medication updates on one user, through the endpoint and through
+the previous read-modify-write implementation, and reports lost updates and Mongo
+commands per request. Also checks that concurrent creates with the same email
+produce a single user.
+
+    mongod --dbpath /tmp/mongo-data &
+    python bench/check_user_concurrency.py --requests 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_TLS", "0")
+
+from bson import ObjectId
+from pymongo import ReturnDocument, monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    IGNORED = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue"}
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in self.IGNORED:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = CommandCounter()
+# Must be registered before app creates its client.
+monitoring.register(counter)
+
+import app  # noqa: E402
+from user_utils import MedicationUpdate, User  # noqa: E402
+
+
+async def legacy_update_medications(id: str, medication_update: MedicationUpdate):
+    # The previous implementation: read, diff in Python, write the whole list back.
+    user = await app.collection.find_one({"_id": ObjectId(id)})
+    current_medications = set(user.get("medications", []))
+    current_medications.difference_update(medication_update.medicationsToRemove)
+    current_medications.update(medication_update.medicationsToAdd)
+    return await app.collection.find_one_and_update(
+        {"_id": ObjectId(id)},
+        {"$set": {"medications": list(current_medications)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def check_updates(update, requests: int):
+    user = (await app.get_or_create_user(User(
+        name="Concurrency Check", email=f"check-{uuid.uuid4().hex}@example.com",
+        medications=["keep", "drop"], gender="female", age="40", pregnant=False,
+    )))["user"]
+    before = counter.count
+    # Every request adds its own medication; the odd ones also remove "drop".
+    await asyncio.gather(*(
+        update(user["id"], MedicationUpdate(medicationsToAdd=[f"med-{i}"], medicationsToRemove=["drop"] if i % 2 else []))
+        for i in range(requests)
+    ))
+    commands = counter.count - before
+    final = set((await app.collection.find_one({"_id": ObjectId(user["id"])}))["medications"])
+    await app.collection.delete_one({"_id": ObjectId(user["id"])})
+    expected = {"keep"} | {f"med-{i}" for i in range(requests)}
+    return {
+        "lost_updates": len(expected - final),
+        "stale_values": len(final - expected),
+        "commands_per_request": round(commands / requests, 2),
+    }
+
+
+async def check_creates(requests: int):
+    email = f"check-{uuid.uuid4().hex}@example.com"
+    before = counter.count
+    await asyncio.gather(*(
+        app.get_or_create_user(User(name="Concurrency Check", email=email, medications=[], gender="male", age="30", pregnant=False))
+        for _ in range(requests)
+    ))
+    commands = counter.count - before
+    users = await app.collection.count_documents({"email": email})
+    await app.collection.delete_many({"email": email})
+    return {"users_created": users, "commands_per_request": round(commands / requests, 2)}
+
+
+async def main_async(requests: int):
+    app.get_db()
+    await app.collection.create_index("email", unique=True)
+    results = {
+        "update_medications": await check_updates(app.update_medications, requests),
+        "legacy_update_medications": await check_updates(legacy_update_medications, requests),
+        "get_or_create_user": await check_creates(requests),
+    }
+    for name, result in results.items():
+        print(f"{name:>26}: " + ", ".join(f"{key} {value}" for key, value in result.items()))
+    ok = results["update_medications"]["lost_updates"] == 0 and results["get_or_create_user"]["users_created"] == 1
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main_async(args.requests)) else 1)
+
+
+if __name__ == "__main__":
+    main()
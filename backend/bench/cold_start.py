@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Measures worker cold start: importing app, running its startup (lifespan) and serving
+the first /api/medications request, each trial in a fresh interpreter.
+
+    python bench/cold_start.py --catalog-size 100000 --trials 5
+    python bench/cold_start.py --mongo-uri mongodb://localhost:27017 --json cold_start.json
+
+Trials run once without the catalog snapshot (every worker reads and indexes the whole
+collection) and once with it (the first trial writes the snapshot, the others load it).
+The boto3 client is real but never called, so no AWS credentials are needed. Without
+--mongo-uri the catalog lives in mongomock (pip install mongomock); seeding it is not
+part of the measured time.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+
+def trial(args):
+    """
+    One cold start, in this (fresh) process; prints its timings as JSON.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import asyncio
+
+    from fakes import AsyncMongomockDatabase, synthetic_names
+
+    names = synthetic_names(args.catalog_size, args.seed)
+    if args.mongo_uri:
+        import pymongo
+        sync_db = pymongo.MongoClient(args.mongo_uri)["medilocate_bench"]
+        db = None
+    else:
+        db = AsyncMongomockDatabase()
+        sync_db = db.sync
+    if args.seed_catalog:
+        sync_db["medications"].delete_many({})
+        sync_db["medications"].insert_many([{"name": name} for name in names], ordered=False)
+        sync_db["catalog_meta"].update_one({"_id": "medications"}, {"$inc": {"version": 1}}, upsert=True)
+    elif db is not None:
+        # mongomock starts empty in every process.
+        sync_db["medications"].insert_many([{"name": name} for name in names], ordered=False)
+        sync_db["catalog_meta"].update_one({"_id": "medications"}, {"$set": {"version": 1}}, upsert=True)
+
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+    if db is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db = AsyncIOMotorClient(args.mongo_uri)["medilocate_bench"]
+    app_module.db = db
+    app_module.collection = db["users"]
+
+    async def start_and_query():
+        import httpx
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with app_module.app.router.lifespan_context(app_module.app):
+            ready = time.perf_counter()
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                response = await client.get("/api/medications", params={"query": names[0].upper()})
+                response.raise_for_status()
+            return ready, time.perf_counter()
+
+    ready, first_response = asyncio.run(start_and_query())
+    print(json.dumps({
+        "import_seconds": imported - started,
+        "startup_seconds": ready - imported,
+        "first_request_seconds": first_response - ready,
+        "cold_start_seconds": first_response - started,
+    }))
+
+
+def run_trials(args, snapshot_path, count):
+    env = dict(
+        os.environ,
+        MONGO_URI=args.mongo_uri or "mongodb://localhost:27017",
+        MONGO_TLS="0",
+        CATALOG_SNAPSHOT_PATH=snapshot_path,
+        AWS_ACCESS_KEY_ID=os.environ.get("AWS_ACCESS_KEY_ID", "cold-start"),
+        AWS_SECRET_ACCESS_KEY=os.environ.get("AWS_SECRET_ACCESS_KEY", "cold-start"),
+    )
+    env.pop("SAGEMAKER_FAKE", None)
+    command = [sys.executable, os.path.abspath(__file__), "--trial", "--catalog-size", str(args.catalog_size), "--seed", str(args.seed)]
+    if args.mongo_uri:
+        command += ["--mongo-uri", args.mongo_uri]
+    results = []
+    for i in range(count):
+        # Against a real mongod the catalog is seeded once, by the first trial.
+        seed = ["--seed-catalog"] if args.mongo_uri and i == 0 and not snapshot_path else []
+        output = subprocess.run(command + seed, env=env, cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def summarize(label, results):
+    keys = ["import_seconds", "startup_seconds", "first_request_seconds", "cold_start_seconds"]
+    summary = {key: round(sorted(r[key] for r in results)[len(results) // 2], 3) for key in keys}
+    print(f"{label:>22} " + " ".join(f"{summary[key]:>12}" for key in keys))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog-size", type=int, default=50000)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--mongo-uri", help="Use this (local) mongod instead of mongomock; data goes to the medilocate_bench database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the medians to this file")
+    parser.add_argument("--trial", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed-catalog", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.trial:
+        trial(args)
+        return
+
+    print(f"Median of {args.trials} trials, catalog of {args.catalog_size} names (seconds)")
+    print(f"{'':>22} {'import':>12} {'startup':>12} {'first request':>12} {'total':>12}")
+    results = {"without_snapshot": summarize("without snapshot", run_trials(args, "", args.trials))}
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "medication_index.pkl")
+        # The first worker builds the index and writes the snapshot.
+        run_trials(args, snapshot_path, 1)
+        results["with_snapshot"] = summarize("with snapshot", run_trials(args, snapshot_path, args.trials))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
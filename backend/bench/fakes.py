@@ -0,0 +1,167 @@
+"""
+Local stand-ins for the benchmark harness: a synthetic medication catalog, an async
+wrapper over mongomock with the subset of the Motor API the app uses, and a stub
+openFDA server.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+_SYLLABLES = ["ad", "vil", "ty", "le", "nol", "zo", "loft", "cou", "ma", "din", "ami", "pro", "fen", "ox", "cin", "tra", "zep", "lor", "xa", "pam", "met", "for", "min", "sta", "tin", "ace", "ril", "dol", "na", "pine"]
+_SUFFIXES = ["", "", "", " PM", " Extra Strength", " Cold & Flu", " Junior", " XR", " 24 Hour"]
+
+
+def synthetic_names(count: int, seed: int = 0) -> List[str]:
+    """
+    `count` distinct brand-like names ("Zolofen PM", "Tramin XR", ...).
+    """
+    rng = random.Random(seed)
+    names = {}
+    while len(names) < count:
+        stem = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        name = stem + rng.choice(_SUFFIXES)
+        names.setdefault(name.lower(), name)
+    return list(names.values())
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def batch_size(self, size: int) -> "AsyncCursor":
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncCollection:
+    """
+    Motor-style coroutine methods over a mongomock collection. mongomock does not
+    implement every update operator (e.g. $setDifference in update pipelines).
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs) -> AsyncCursor:
+        return AsyncCursor(self._collection.find(*args, **kwargs))
+
+    def __getattr__(self, name: str):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AsyncMongomockDatabase:
+    def __init__(self, name: str = "medilocate"):
+        import mongomock
+        self._db = mongomock.MongoClient()[name]
+        self._collections: Dict[str, AsyncCollection] = {}
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        if name not in self._collections:
+            self._collections[name] = AsyncCollection(self._db[name])
+        return self._collections[name]
+
+    @property
+    def sync(self):
+        return self._db
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 refuses connections under load, which the client retries.
+    request_queue_size = 256
+
+
+class FDAStubServer:
+    """
+    Answers /drug/label.json like openFDA: `openfda.brand_name:X` returns a label for
+    catalog names and a 404 otherwise, `drug_interactions:X` returns an interaction
+    section that mentions a few catalog names. Every response waits `latency` seconds.
+    Statuses appended to `errors` are answered first, one per request.
+    """
+
+    def __init__(self, names: Sequence[str], latency: float = 0.05, seed: int = 0):
+        self.latency = latency
+        self.requests = 0
+        self.errors: List[int] = []
+        known = {name.lower(): name for name in names}
+        rng = random.Random(seed)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                url = urlparse(self.path)
+                search = parse_qs(url.query).get("search", [""])[0]
+                field, _, term = search.partition(":")
+                label = None
+                if url.path == "/drug/label.json" and field == "openfda.brand_name" and term.lower() in known:
+                    label = stub_label(known[term.lower()])
+                elif url.path == "/drug/label.json" and field == "drug_interactions" and term:
+                    mentioned = ", ".join(rng.sample(list(known.values()), min(3, len(known))))
+                    label = stub_label(term, interactions=f"Taking {term} with {mentioned} may increase the risk of bleeding. Ask a doctor before use.")
+                if stub.errors:
+                    status = stub.errors.pop(0)
+                    body = {"error": {"code": "SERVER_ERROR", "message": f"HTTP {status}"}}
+                elif label is None:
+                    body, status = {"error": {"code": "NOT_FOUND", "message": "No matches found!"}}, 404
+                else:
+                    body, status = {"meta": {}, "results": [label]}, 200
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _StubHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FDAStubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def stub_label(name: str, interactions: str = "") -> Dict[str, Any]:
+    return {
+        "openfda": {"brand_name": [name]},
+        "purpose": [f"{name} is a pain reliever and fever reducer."],
+        "indication_and_usage": ["Temporarily relieves minor aches and pains."],
+        "active_ingredient": ["Ibuprofen 200 mg"],
+        "do_not_use": ["Right before or after heart surgery."],
+        "warnings": ["Allergy alert: may cause a severe allergic reaction. " * 5],
+        "dosage_and_administration": ["Adults and children 12 years and over: take 1 tablet every 4 to 6 hours."],
+        "pregnancy_or_breast_feeding": ["Ask a health professional before use."],
+        "ask_doctor": ["Ask a doctor before use if you have stomach problems."],
+        "drug_interactions": [interactions or "Ask a doctor before use if you are taking a blood thinner."],
+    }
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+
+from instrumentation import span
+from medication_matcher import MedicationIndex, build_medication_index, fetch_medication_catalog, format_memory_report, load_index_snapshot, save_index_snapshot
+
+# Reload the catalog at least this often, even if nothing signalled a change (0 = never).
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "3600"))
+# How often the background task checks the version document.
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "60"))
+# Also listen to a MongoDB change stream on "medications" (needs a replica set / Atlas).
+CATALOG_CHANGE_STREAM = os.getenv("CATALOG_CHANGE_STREAM", "").lower() in ("1", "true", "yes")
+# Changes arriving within this window are folded into a single reload (bulk loads emit many events).
+CATALOG_CHANGE_DEBOUNCE_SECONDS = float(os.getenv("CATALOG_CHANGE_DEBOUNCE_SECONDS", "5"))
+# Every rebuilt index is saved here, and a new worker starts from it instead of reading and
+# indexing the whole collection when the catalog version has not changed ("" = off). The
+# file is unpickled, so point it at a data directory only this service can write to, e.g.
+# /var/lib/medicheck/medication_index.pkl.
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+
+# The loader scripts bump {"_id": "medications", "version": n} here after every import.
+CATALOG_META_COLLECTION = "catalog_meta"
+CATALOG_META_ID = "medications"
+
+
+class CatalogCache:
+    """
+    Holds the current MedicationIndex for this worker and keeps it fresh.
+
+    The index is warmed at startup and rebuilt in the background when the catalog
+    version document changes, when a change stream reports writes, or when the TTL
+    expires. A rebuilt index is swapped in with a single reference assignment, so
+    a request either sees the old index or the new one, never a partial build.
+    """
+
+    def __init__(self):
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._index: Optional[MedicationIndex] = None
+        self._version: Any = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._tasks = []
+        self._changed = asyncio.Event()
+        self.metrics: Dict[str, Any] = {
+            "hits": 0,
+            "misses": 0,
+            "reloads": 0,
+            "reload_failures": 0,
+            "last_reload_seconds": None,
+            "last_reload_at": None,
+            "version": None,
+            "size": 0,
+            "snapshot_loaded": False,
+            "snapshot_load_seconds": None,
+        }
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """
+        Warms the cache and starts the background refresh tasks.
+        """
+        self._db = db
+        if CATALOG_SNAPSHOT_PATH and self._index is None:
+            await self._load_snapshot()
+        try:
+            await self.refresh()
+        except PyMongoError as e:
+            # The first request will retry the load.
+            print("Catalog warmup failed:", e)
+        self._tasks.append(asyncio.create_task(self._poll_loop()))
+        if CATALOG_CHANGE_STREAM:
+            self._tasks.append(asyncio.create_task(self._change_stream_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def get(self) -> MedicationIndex:
+        index = self._index
+        if index is not None:
+            self.metrics["hits"] += 1
+            return index
+        self.metrics["misses"] += 1
+        async with self._lock:
+            if self._index is None:
+                await self._reload(await self._read_version())
+        return self._index
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        Reloads the catalog if its version changed or the TTL expired.
+        Returns True when a new index was swapped in.
+        """
+        async with self._lock:
+            version = await self._read_version()
+            expired = CATALOG_TTL_SECONDS > 0 and time.monotonic() - self._loaded_at >= CATALOG_TTL_SECONDS
+            if not force and self._index is not None and version == self._version and not expired:
+                return False
+            await self._reload(version)
+            return True
+
+    async def _load_snapshot(self):
+        started = time.perf_counter()
+        try:
+            with span("catalog_snapshot_load"):
+                snapshot = await asyncio.to_thread(load_index_snapshot, CATALOG_SNAPSHOT_PATH)
+        except Exception as e:
+            print("Could not load the catalog snapshot:", e)
+            return
+        if snapshot is None or snapshot[0] is None:
+            return
+        self._version, self._index = snapshot
+        # The snapshot is as old as the file, which counts towards the TTL.
+        age = time.time() - os.path.getmtime(CATALOG_SNAPSHOT_PATH)
+        self._loaded_at = time.monotonic() - max(age, 0.0)
+        self.metrics.update(
+            snapshot_loaded=True,
+            snapshot_load_seconds=round(time.perf_counter() - started, 3),
+            version=self._version,
+            size=len(self._index),
+        )
+        print(f"Loaded catalog version {self._version} ({len(self._index)} names) from {CATALOG_SNAPSHOT_PATH}")
+
+    async def _save_snapshot(self, index: MedicationIndex, version: Any):
+        try:
+            await asyncio.to_thread(save_index_snapshot, index, CATALOG_SNAPSHOT_PATH, version)
+        except Exception as e:
+            print("Could not save the catalog snapshot:", e)
+
+    async def _read_version(self) -> Any:
+        meta = await self._db[CATALOG_META_COLLECTION].find_one({"_id": CATALOG_META_ID}, {"version": 1})
+        return meta.get("version") if meta else None
+
+    async def _reload(self, version: Any):
+        started = time.perf_counter()
+        try:
+            with span("catalog_load"):
+                catalog = await fetch_medication_catalog(self._db)
+            # Building the index is CPU-bound; keep it off the event loop.
+            with span("catalog_index_build"):
+                index = await asyncio.to_thread(build_medication_index, catalog)
+        except Exception:
+            self.metrics["reload_failures"] += 1
+            raise
+        self._index = index
+        self._version = version
+        self._loaded_at = time.monotonic()
+        duration = time.perf_counter() - started
+        self.metrics.update(
+            reloads=self.metrics["reloads"] + 1,
+            last_reload_seconds=round(duration, 3),
+            last_reload_at=time.time(),
+            version=version,
+            size=len(index),
+        )
+        print(f"Loaded catalog version {version} ({len(index)} names) in {duration:.2f}s, memory: {format_memory_report(index.memory_report())}")
+        # Without a version document a snapshot could not be told apart from a stale one.
+        if CATALOG_SNAPSHOT_PATH and version is not None:
+            await self._save_snapshot(index, version)
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=CATALOG_POLL_SECONDS)
+                # Let a burst of change events settle before reloading.
+                await asyncio.sleep(CATALOG_CHANGE_DEBOUNCE_SECONDS)
+                self._changed.clear()
+                await self.refresh(force=True)
+            except asyncio.TimeoutError:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    print("Catalog refresh failed:", e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Catalog refresh failed:", e)
+
+    async def _change_stream_loop(self):
+        while True:
+            try:
+                # Renames and drops invalidate the stream, so it is reopened in a loop.
+                async with self._db["medications"].watch() as stream:
+                    async for _ in stream:
+                        self._changed.set()
+                self._changed.set()
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                print("Catalog change stream error:", e)
+                await asyncio.sleep(CATALOG_POLL_SECONDS)
+
+
+catalog_cache = CatalogCache()
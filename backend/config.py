@@ -1,6 +1,5 @@
 import os
 from dotenv import load_dotenv
-import boto3
 
 # Load variables from a .env file
 load_dotenv()  
@@ -10,11 +9,36 @@ AWS_REGION = os.environ.get('AWS_REGION', 'us-east-2')
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 
-sagemaker_runtime = boto3.client(
-    'sagemaker-runtime',
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
+# Max concurrent invoke_endpoint calls per worker, and per-call timeout in seconds
+SAGEMAKER_MAX_IN_FLIGHT = int(os.environ.get('SAGEMAKER_MAX_IN_FLIGHT', '8'))
+SAGEMAKER_TIMEOUT_SECONDS = float(os.environ.get('SAGEMAKER_TIMEOUT_SECONDS', '60'))
+
+# Set SAGEMAKER_FAKE=1 to use the in-process fake endpoint (tests and benchmarks)
+SAGEMAKER_FAKE = os.environ.get('SAGEMAKER_FAKE', '').lower() in ('1', 'true', 'yes')
+SAGEMAKER_FAKE_LATENCY = float(os.environ.get('SAGEMAKER_FAKE_LATENCY', '0.5'))
+
+def create_sagemaker_runtime():
+    """
+    Builds the sagemaker-runtime client. boto3 is imported here rather than at module
+    level, since importing it and building the client is a large part of worker startup.
+    """
+    if SAGEMAKER_FAKE:
+        from sagemaker_fake import FakeSageMakerRuntime
+        return FakeSageMakerRuntime(latency=SAGEMAKER_FAKE_LATENCY)
+
+    import boto3
+    from botocore.config import Config
+    return boto3.client(
+        'sagemaker-runtime',
+        region_name=AWS_REGION,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        config=Config(
+            connect_timeout=5,
+            read_timeout=SAGEMAKER_TIMEOUT_SECONDS,
+            retries={'max_attempts': 2, 'mode': 'standard'},
+            max_pool_connections=SAGEMAKER_MAX_IN_FLIGHT
+        )
+    )
 
 ENDPOINT_NAME = "jumpstart-dft-llama-3-1-8b-instruct-20250302-093626"
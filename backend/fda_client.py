@@ -0,0 +1,138 @@
+import asyncio
+import os
+from typing import Any, Dict, Optional
+import httpx
+
+from cache_utils import MISSING, SingleFlight, TTLCache
+from instrumentation import span
+
+# Point this at a local stub server to run without api.fda.gov.
+OPENFDA_BASE_URL = os.getenv("OPENFDA_BASE_URL", "https://api.fda.gov")
+OPENFDA_API_KEY = os.getenv("OPENFDA_API_KEY")
+FDA_TIMEOUT_SECONDS = float(os.getenv("FDA_TIMEOUT_SECONDS", "10"))
+FDA_MAX_RETRIES = int(os.getenv("FDA_MAX_RETRIES", "2"))
+FDA_BACKOFF_SECONDS = float(os.getenv("FDA_BACKOFF_SECONDS", "0.5"))
+FDA_MAX_CONNECTIONS = int(os.getenv("FDA_MAX_CONNECTIONS", "20"))
+FDA_CACHE_SIZE = int(os.getenv("FDA_CACHE_SIZE", "2048"))
+FDA_CACHE_TTL_SECONDS = float(os.getenv("FDA_CACHE_TTL_SECONDS", "21600"))
+# "No label found" answers are cached for a shorter time.
+FDA_NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("FDA_NEGATIVE_CACHE_TTL_SECONDS", "600"))
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FDAError(Exception):
+    pass
+
+
+def label_field(label: Dict[str, Any], key: str) -> str:
+    """
+    openFDA returns most label sections as lists of strings; join them into one.
+    """
+    value = label.get(key, "")
+    if isinstance(value, list):
+        return " ".join(value)
+    return value
+
+
+class FDAClient:
+    """
+    Async openFDA drug label client.
+
+    A single pooled httpx.AsyncClient is shared by all requests of the worker.
+    Label documents are cached (LRU + TTL) by search term, and concurrent
+    lookups of the same term share one upstream call.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OPENFDA_BASE_URL,
+        timeout: float = FDA_TIMEOUT_SECONDS,
+        max_retries: int = FDA_MAX_RETRIES,
+        backoff: float = FDA_BACKOFF_SECONDS,
+        cache_size: int = FDA_CACHE_SIZE,
+        cache_ttl: float = FDA_CACHE_TTL_SECONDS,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._single_flight = SingleFlight()
+        self._http: Optional[httpx.AsyncClient] = None
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=FDA_MAX_CONNECTIONS, max_keepalive_connections=FDA_MAX_CONNECTIONS),
+            )
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def label_by_brand_name(self, medication: str) -> Optional[Dict[str, Any]]:
+        return await self.search_label(f"openfda.brand_name:{medication}")
+
+    async def interaction_label(self, medication: str) -> Optional[Dict[str, Any]]:
+        return await self.search_label(f"drug_interactions:{medication}")
+
+    async def search_label(self, search: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the first label matching an openFDA search expression,
+        or None when openFDA has no match.
+        """
+        key = " ".join(search.lower().split())
+        label = self.cache.get(key)
+        if label is not MISSING:
+            return label
+        return await self._single_flight.do(key, lambda: self._fetch_and_cache(key, search))
+
+    async def _fetch_and_cache(self, key: str, search: str) -> Optional[Dict[str, Any]]:
+        with span("fda_fetch"):
+            label = await self._fetch(search)
+        self.cache.set(key, label, None if label is not None else FDA_NEGATIVE_CACHE_TTL_SECONDS)
+        return label
+
+    async def _fetch(self, search: str) -> Optional[Dict[str, Any]]:
+        params = {"search": search, "limit": 1}
+        if OPENFDA_API_KEY:
+            params["api_key"] = OPENFDA_API_KEY
+        for attempt in range(self.max_retries + 1):
+            self.upstream_calls += 1
+            try:
+                response = await self._client().get("/drug/label.json", params=params)
+            except httpx.TransportError as e:
+                error = FDAError(f"{type(e).__name__}: {e}")
+            else:
+                if response.status_code == 404:
+                    # openFDA answers "no matches" with a 404.
+                    return None
+                if response.status_code not in _RETRY_STATUSES:
+                    if response.is_error:
+                        self.upstream_errors += 1
+                        raise FDAError(f"openFDA returned HTTP {response.status_code}")
+                    results = response.json().get("results") or []
+                    return results[0] if results else None
+                error = FDAError(f"openFDA returned HTTP {response.status_code}")
+            self.upstream_errors += 1
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "coalesced": self._single_flight.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+        }
+
+
+fda_client = FDAClient()
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from cache_utils import MISSING, SingleFlight, TTLCache
+
+# "memory" (in-process only), "mongo" (shared generation_cache collection) or "file" (shared directory)
+GENERATION_CACHE_BACKEND = os.getenv("GENERATION_CACHE_BACKEND", "memory")
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "1024"))
+GENERATION_CACHE_TTL_SECONDS = float(os.getenv("GENERATION_CACHE_TTL_SECONDS", "86400"))
+GENERATION_CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", ".generation_cache")
+GENERATION_CACHE_MAX_FILES = int(os.getenv("GENERATION_CACHE_MAX_FILES", "100000"))
+
+# Bump whenever the translation prompt changes so shared tiers stop serving old outputs.
+TRANSLATION_PROMPT_VERSION = 1
+
+# Upper age bound (exclusive), bucket name, description used in the prompt.
+# The pediatric bands follow the ones OTC labels use for dosing.
+AGE_BUCKETS = [
+    (2, "infant", "a child under 2 years old"),
+    (6, "young_child", "a child 2 to 5 years old"),
+    (12, "child", "a child 6 to 11 years old"),
+    (18, "adolescent", "an adolescent 12 to 17 years old"),
+    (65, "adult", "an adult 18 to 64 years old"),
+    (None, "elderly", "an elderly adult 65 years or older"),
+]
+
+
+def age_bucket(age: Any) -> Tuple[str, str]:
+    """
+    Maps the user's age (stored as a string) to a coarse (bucket, description) pair.
+    Unparseable ages fall back to the adult bucket.
+    """
+    try:
+        years = float(age)
+    except (TypeError, ValueError):
+        years = 30.0
+    for upper, bucket, description in AGE_BUCKETS:
+        if upper is None or years < upper:
+            return bucket, description
+    return AGE_BUCKETS[-1][1], AGE_BUCKETS[-1][2]
+
+
+def translation_cache_key(text: str, bucket: str, gender: str, pregnant: bool, max_new_tokens: int, top_p: float, temperature: float) -> str:
+    normalized = {
+        "version": TRANSLATION_PROMPT_VERSION,
+        "text": " ".join(text.split()),
+        "age": bucket,
+        "gender": str(gender).strip().lower(),
+        "pregnant": bool(pregnant),
+        "max_new_tokens": int(max_new_tokens),
+        "top_p": round(float(top_p), 4),
+        "temperature": round(float(temperature), 4),
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class MongoGenerationStore:
+    """
+    Shared tier backed by a Mongo collection; a TTL index on expires_at evicts old entries.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, collection_name: str = "generation_cache"):
+        self.collection = db[collection_name]
+        self._indexed = False
+
+    async def get(self, key: str) -> Any:
+        doc = await self.collection.find_one({"_id": key}, {"value": 1, "expires_at": 1})
+        if doc is None or doc["expires_at"] <= datetime.now(timezone.utc).replace(tzinfo=None):
+            # The TTL monitor only runs once a minute, so expiry is also checked here.
+            return MISSING
+        return doc["value"]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        if not self._indexed:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=ttl)
+        await self.collection.replace_one({"_id": key}, {"_id": key, "value": value, "expires_at": expires_at}, upsert=True)
+
+
+class FileGenerationStore:
+    """
+    Shared tier for workers on the same host: one JSON file per key in a directory.
+    """
+
+    def __init__(self, directory: str = GENERATION_CACHE_DIR, max_files: int = GENERATION_CACHE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str) -> Any:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return MISSING
+        if entry["expires_at"] <= time.time():
+            return MISSING
+        return entry["value"]
+
+    def _write(self, key: str, value: Any, ttl: float):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + ttl, "value": value}, f)
+        os.replace(tmp_path, path)
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        # Drop the least recently written entries once the directory grows past max_files.
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> Any:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await asyncio.to_thread(self._write, key, value, ttl)
+
+
+class GenerationCache:
+    """
+    Two-tier cache for LLM outputs: an in-process LRU in front of an optional shared
+    store. Concurrent misses for the same key trigger a single generation.
+    """
+
+    def __init__(self, maxsize: int = GENERATION_CACHE_SIZE, ttl: float = GENERATION_CACHE_TTL_SECONDS, shared=None):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, ttl)
+        self.shared = shared
+        self._single_flight = SingleFlight()
+        self.shared_hits = 0
+        self.generations = 0
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        return await self._single_flight.do(key, lambda: self._load_or_generate(key, generate))
+
+    async def lookup(self, key: str) -> Any:
+        """
+        Returns the cached value from either tier without generating, or MISSING.
+        """
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        return await self._lookup_shared(key)
+
+    async def _lookup_shared(self, key: str) -> Any:
+        if self.shared is None:
+            return MISSING
+        try:
+            value = await self.shared.get(key)
+        except Exception as e:
+            print("Generation cache read failed:", e)
+            return MISSING
+        if value is not MISSING:
+            self.shared_hits += 1
+            self.local.set(key, value)
+        return value
+
+    async def store(self, key: str, value: Any):
+        """
+        Adds a value produced outside get_or_generate (e.g. by a streamed generation).
+        """
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                print("Generation cache write failed:", e)
+
+    async def _load_or_generate(self, key: str, generate: Callable[[], Awaitable[Any]]) -> Any:
+        value = await self._lookup_shared(key)
+        if value is not MISSING:
+            return value
+        self.generations += 1
+        value = await generate()
+        await self.store(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.local.stats(),
+            "backend": type(self.shared).__name__ if self.shared is not None else "memory",
+            "shared_hits": self.shared_hits,
+            "coalesced": self._single_flight.coalesced,
+            "generations": self.generations,
+        }
+
+
+def build_shared_store(db: AsyncIOMotorDatabase, backend: str = GENERATION_CACHE_BACKEND) -> Optional[Any]:
+    if backend == "mongo":
+        return MongoGenerationStore(db)
+    if backend == "file":
+        return FileGenerationStore()
+    return None
+
+
+generation_cache = GenerationCache()
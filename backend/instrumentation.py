@@ -0,0 +1,182 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+# Fraction of hot-path debug events that are logged (1 = all, 0 = none).
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Add a Server-Timing header with the per-stage durations of each response.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() in ("1", "true", "yes")
+
+# Seconds; from sub-millisecond matcher calls to full LLM generations.
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("medicheck")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Histogram:
+    """
+    Prometheus-style histogram keyed by a tuple of label values. Spans finish on
+    worker threads too, so updates take a lock.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...] = _BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            # Per bucket counts, then sum and count.
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = base + "," if base else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {int(count)}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {int(values[-1])}')
+            lines.append(f"{self.name}_sum{{{base}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {int(values[-1])}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_duration = Histogram("medicheck_request_duration_seconds", "HTTP request duration.", ("method", "route", "status"))
+stage_duration = Histogram("medicheck_stage_duration_seconds", "Duration of each stage of request handling.", ("stage",))
+
+# Per-request stage durations and notes, set by the middleware; None outside of a request.
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+_request_notes: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("request_notes", default=None)
+
+
+def record(stage: str, seconds: float):
+    stage_duration.observe((stage,), seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def annotate(name: str, value: Any):
+    """
+    Adds `name;desc="value"` to the Server-Timing header of the current request.
+    """
+    notes = _request_notes.get()
+    if notes is not None:
+        notes[name] = str(value)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Times a block as `stage`, for both the /metrics histogram and the Server-Timing
+    header of the current request. Works in coroutines and in threads that run with
+    a copy of the request context (asyncio.to_thread, contextvars.copy_context().run).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def log_sampled(event: str, **fields):
+    """
+    Logs one JSON line for a fraction (LOG_SAMPLE_RATE) of the calls.
+    """
+    if LOG_SAMPLE_RATE > 0 and (LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE):
+        logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str))
+
+
+def server_timing(timings: Mapping[str, float], total: float, notes: Optional[Mapping[str, str]] = None) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    entries.extend(f'{name};desc="{_escape(value)}"' for name, value in (notes or {}).items())
+    return ", ".join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route template. Stages finished before
+    the response headers are sent are reported in a Server-Timing header (for streamed
+    responses that is everything up to the first byte).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: Dict[str, float] = {}
+        notes: Dict[str, str] = {}
+        token = _request_timings.set(timings)
+        notes_token = _request_notes.set(notes)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    header = server_timing(timings, time.perf_counter() - started, notes)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            _request_notes.reset(notes_token)
+            route = scope.get("route")
+            request_duration.observe(
+                (scope["method"], getattr(route, "path", "unmatched"), str(status)),
+                time.perf_counter() - started,
+            )
+
+
+def render_metrics(stats: Optional[Mapping[str, Mapping[str, Any]]] = None) -> str:
+    """
+    Prometheus text exposition of the histograms, plus every numeric value of the given
+    status dicts as a gauge named medicheck_<prefix>_<key>.
+    """
+    lines = request_duration.render() + stage_duration.render()
+    for prefix, values in (stats or {}).items():
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = re.sub(r"[^a-zA-Z0-9_]", "_", f"medicheck_{prefix}_{key}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
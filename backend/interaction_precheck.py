@@ -0,0 +1,213 @@
+import asyncio
+import bisect
+import os
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from cache_utils import SingleFlight
+from medication_matcher import MedicationCatalog
+
+# Set to 1 to skip the LLM when none of the user's medications (or their ingredients) are
+# named in the interaction text, and to send only the sentences naming them. Off by default:
+# labels often describe interactions by drug class ("NSAIDs", "SSRIs"), which names alone miss.
+INTERACTION_PRECHECK = os.getenv("INTERACTION_PRECHECK", "0").lower() in ("1", "true", "yes")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;])\s+|\n+")
+# Salt and form words dropped from ingredient names: labels say "diphenhydramine",
+# the NDC file says "DIPHENHYDRAMINE HYDROCHLORIDE".
+_SALT_TOKENS = frozenset((
+    "hydrochloride", "hcl", "hydrobromide", "sodium", "potassium", "calcium", "magnesium",
+    "sulfate", "maleate", "citrate", "tartrate", "succinate", "besylate", "mesylate",
+    "fumarate", "acetate", "phosphate", "bitartrate", "monohydrate", "dihydrate", "anhydrous",
+))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase alphanumeric tokens, so "Advil-PM" and "advil pm" normalize alike.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    The non-empty sentences of label text, split after . ! ? ; and at line breaks.
+    """
+    return [sentence.strip() for sentence in _SENTENCE_END_RE.split(text) if sentence.strip()]
+
+
+class TokenAutomaton:
+    """
+    Aho-Corasick automaton over word tokens rather than characters: patterns are token
+    sequences, so matches always fall on word boundaries, and the trie has one node per
+    distinct name prefix instead of one per character.
+    """
+
+    def __init__(self, patterns: Iterable[Sequence[str]]):
+        self.vocab: Dict[str, int] = {}
+        self.patterns: List[Tuple[str, ...]] = []
+        self._goto: Dict[Tuple[int, int], int] = {}
+        self._output = [-1]
+        seen: Dict[Tuple[str, ...], int] = {}
+        for tokens in patterns:
+            tokens = tuple(tokens)
+            if not tokens or tokens in seen:
+                continue
+            seen[tokens] = len(self.patterns)
+            self.patterns.append(tokens)
+            node = 0
+            for token in tokens:
+                token_id = self.vocab.setdefault(token, len(self.vocab))
+                child = self._goto.get((node, token_id))
+                if child is None:
+                    child = len(self._output)
+                    self._goto[(node, token_id)] = child
+                    self._output.append(-1)
+                node = child
+            self._output[node] = seen[tokens]
+        self._build_links()
+
+    def _build_links(self):
+        size = len(self._output)
+        children: List[List[Tuple[int, int]]] = [[] for _ in range(size)]
+        for (node, token_id), child in self._goto.items():
+            children[node].append((token_id, child))
+        self._fail = [0] * size
+        # Nearest node on the fail chain that ends a pattern (-1 if none).
+        self._dict_link = [-1] * size
+        queue = deque(child for _, child in children[0])
+        while queue:
+            node = queue.popleft()
+            for token_id, child in children[node]:
+                fail = self._fail[node]
+                while fail and (fail, token_id) not in self._goto:
+                    fail = self._fail[fail]
+                target = self._goto.get((fail, token_id), 0)
+                self._fail[child] = target if target != child else 0
+                link = self._fail[child]
+                self._dict_link[child] = link if self._output[link] >= 0 else self._dict_link[link]
+                queue.append(child)
+
+    def find_all(self, tokens: Sequence[str]) -> List[Tuple[int, int]]:
+        """
+        Returns (pattern_id, end_token_index) for every occurrence in `tokens`.
+        """
+        matches = []
+        node = 0
+        for position, token in enumerate(tokens):
+            token_id = self.vocab.get(token)
+            if token_id is None:
+                node = 0
+                continue
+            while node and (node, token_id) not in self._goto:
+                node = self._fail[node]
+            node = self._goto.get((node, token_id), 0)
+            hit = node if self._output[node] >= 0 else self._dict_link[node]
+            while hit >= 0:
+                matches.append((self._output[hit], position))
+                hit = self._dict_link[hit]
+        return matches
+
+
+class PrecheckResult(NamedTuple):
+    # User medications that the interaction text may refer to.
+    matched_medications: List[str]
+    # Sentences of the interaction text that mention them.
+    sentences: List[str]
+
+
+def _contains(haystack: Sequence[str], needle: Sequence[str]) -> bool:
+    size = len(needle)
+    return any(tuple(haystack[i:i + size]) == tuple(needle) for i in range(len(haystack) - size + 1))
+
+
+def ingredient_tokens(ingredient: str) -> List[str]:
+    tokens = tokenize(ingredient)
+    return [token for token in tokens if token not in _SALT_TOKENS] or tokens
+
+
+def precheck_interactions(
+    interaction_text: str,
+    current_medications: Sequence[str],
+    automaton: TokenAutomaton,
+    ingredients: Optional[Mapping[str, Sequence[str]]] = None,
+) -> PrecheckResult:
+    """
+    Finds which of the user's medications the FDA interaction text can be about.
+
+    Catalog names mentioned in the text are found in one pass of the automaton; a user
+    medication matches when one of those names is part of it ("Advil" in "Advil PM") or
+    when the medication itself appears in the text (names missing from the catalog).
+    With `ingredients` (lowercase name -> active ingredients), a medication also matches
+    when one of its ingredients appears ("ibuprofen" for "Advil").
+
+    Labels usually name generics ("warfarin" for "Coumadin"), so a medication without
+    ingredient data can only be ruled out by the LLM: if the user takes any, every
+    medication and every sentence is returned, i.e. the full prompt. Interactions stated
+    only by drug class ("NSAIDs" for "Advil") are not found.
+    """
+    if not interaction_text or not current_medications:
+        return PrecheckResult([], [])
+
+    # Tokenize sentence by sentence, remembering where each sentence's tokens start.
+    sentences = split_sentences(interaction_text)
+    if any(not ingredients or not ingredients.get(medication.lower()) for medication in current_medications):
+        return PrecheckResult(list(current_medications), sentences)
+    tokens: List[str] = []
+    starts: List[int] = []
+    for sentence in sentences:
+        starts.append(len(tokens))
+        tokens.extend(tokenize(sentence))
+
+    # (token sequence, end position) of every catalog name mentioned in the text
+    mentions = [(automaton.patterns[pattern_id], end) for pattern_id, end in automaton.find_all(tokens)]
+
+    matched_medications = []
+    matched_sentences = set()
+    for medication in current_medications:
+        med_tokens = tokenize(medication)
+        if not med_tokens:
+            continue
+        hits = [end for pattern, end in mentions if _contains(med_tokens, pattern)]
+        terms = [med_tokens]
+        if ingredients:
+            terms.extend(ingredient_tokens(ingredient) for ingredient in ingredients.get(medication.lower(), ()))
+        for term in terms:
+            size = len(term)
+            hits.extend(
+                i + size - 1 for i in range(len(tokens) - size + 1) if size and tokens[i:i + size] == term
+            )
+        if hits:
+            matched_medications.append(medication)
+            matched_sentences.update(bisect.bisect_right(starts, end) - 1 for end in hits)
+    return PrecheckResult(matched_medications, [sentences[i] for i in sorted(matched_sentences)])
+
+
+def build_automaton(catalog: MedicationCatalog) -> TokenAutomaton:
+    return TokenAutomaton(tokenize(name) for name in catalog.normalized)
+
+
+_automaton: Optional[Tuple[MedicationCatalog, TokenAutomaton]] = None
+_single_flight = SingleFlight()
+
+
+async def get_automaton(catalog: MedicationCatalog) -> TokenAutomaton:
+    """
+    Automaton for the given catalog, rebuilt (off the event loop) when the catalog is swapped.
+    """
+    global _automaton
+    if _automaton is not None and _automaton[0] is catalog:
+        return _automaton[1]
+
+    async def build():
+        global _automaton
+        automaton = await asyncio.to_thread(build_automaton, catalog)
+        if len(catalog) and not catalog.ingredients:
+            print("The medication catalog has no ingredient data (load it with bulk_load_medications.py --source catalog), "
+                  "so the interaction precheck sends every label to the LLM.")
+        _automaton = (catalog, automaton)
+        return automaton
+
+    return await _single_flight.do(id(catalog), build)
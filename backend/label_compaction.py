@@ -0,0 +1,180 @@
+import importlib.util
+import os
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+from fda_client import label_field
+from interaction_precheck import split_sentences, tokenize
+
+# Set to 0 to send every label section in full.
+LABEL_COMPACTION = os.getenv("LABEL_COMPACTION", "1").lower() in ("1", "true", "yes")
+# Tokens of label text kept for the translation prompt (0 = no limit, only deduplicate).
+LABEL_TOKEN_BUDGET = int(os.getenv("LABEL_TOKEN_BUDGET", "768"))
+# A tokenizer.json (e.g. the endpoint model's) or a Hugging Face tokenizer id, loaded with
+# the `tokenizers` package when the worker starts. Unset by default: LABEL_TOKEN_BUDGET and
+# the token counts in /metrics are then estimates at 4 characters per token.
+LABEL_TOKENIZER = os.getenv("LABEL_TOKENIZER", "")
+
+# (field, title, weight): the weight ranks a section's sentences against the others'.
+LABEL_SECTIONS = [
+    ("purpose", "Purpose", 3.0),
+    ("indication_and_usage", "Indication and Usage", 2.5),
+    ("active_ingredient", "Active Ingredient", 3.0),
+    ("do_not_use", "Do not use", 2.0),
+    ("warnings", "Warnings", 1.5),
+    ("instruction_for_use", "Instruction For Use", 1.0),
+    ("drug_interactions", "Drug Interactions", 1.0),
+    ("dosage_and_administration", "Dosage", 2.0),
+    ("pregnancy_or_breast_feeding", "Pregnancy or Breastfeeding", 1.0),
+    ("ask_doctor", "Ask Doctor", 1.0),
+    ("ask_doctor_or_pharmacist", "Ask Doctor or Pharmacist", 1.0),
+]
+
+_CHILD_RE = re.compile(r"\b(child|children|pediatric|infants?|under \d+ years?)\b", re.IGNORECASE)
+_ELDERLY_RE = re.compile(r"\b(elderly|older adults?|over 6\d|6\d (?:years )?(?:and|or) (?:older|over))\b", re.IGNORECASE)
+_ADULT_RE = re.compile(r"\badults?\b", re.IGNORECASE)
+_PREGNANCY_RE = re.compile(r"\b(pregnan\w*|breast[- ]?feeding|nursing)\b", re.IGNORECASE)
+_CHILD_BUCKETS = {"infant", "young_child", "child", "adolescent"}
+
+# Totals over the labels compacted by this worker.
+compaction_stats: Dict[str, int] = {"labels": 0, "original_tokens": 0, "tokens": 0, "tokens_saved": 0}
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+_tokenizer_failed = False
+_stats_lock = threading.Lock()
+
+
+class CompactLabel(NamedTuple):
+    text: str
+    original_tokens: int
+    tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+def format_label(label: Dict[str, Any]) -> str:
+    """
+    The label sections for the translation prompt as they are, one per line.
+    """
+    return "\n".join(f"{title}: {label_field(label, field)}" for field, title, _ in LABEL_SECTIONS)
+
+
+def load_tokenizer():
+    """
+    Loads LABEL_TOKENIZER (reading or downloading it), or returns None when counts are
+    estimated. Blocking: the app calls it in a thread at startup.
+    """
+    global _tokenizer, _tokenizer_failed
+    if not LABEL_TOKENIZER or _tokenizer_failed:
+        return None
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            if importlib.util.find_spec("tokenizers") is None:
+                print("tokenizers is not installed, estimating label token counts.")
+                _tokenizer_failed = True
+                return None
+            from tokenizers import Tokenizer
+            try:
+                if os.path.exists(LABEL_TOKENIZER):
+                    _tokenizer = Tokenizer.from_file(LABEL_TOKENIZER)
+                else:
+                    _tokenizer = Tokenizer.from_pretrained(LABEL_TOKENIZER)
+            except Exception as e:
+                print("Could not load the label tokenizer, estimating token counts:", e)
+                _tokenizer_failed = True
+    return _tokenizer
+
+
+def count_tokens(texts: Sequence[str]) -> List[int]:
+    """
+    Token counts of the texts, with LABEL_TOKENIZER when available.
+    """
+    tokenizer = load_tokenizer()
+    if tokenizer is None:
+        return [(len(text) + 3) // 4 for text in texts]
+    return [len(encoding.ids) for encoding in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+
+def _relevance(sentence: str, age_bucket: str, pregnant: bool) -> float:
+    """
+    Multiplier for how much a sentence concerns a user of this age bucket and pregnancy status.
+    """
+    score = 1.0
+    child, adult, elderly = _CHILD_RE.search(sentence), _ADULT_RE.search(sentence), _ELDERLY_RE.search(sentence)
+    if age_bucket in _CHILD_BUCKETS:
+        if child:
+            score += 1.0
+        elif adult or elderly:
+            score *= 0.5
+    else:
+        if elderly and age_bucket == "elderly":
+            score += 1.0
+        elif adult:
+            score += 0.5
+        elif child:
+            score *= 0.5
+    if _PREGNANCY_RE.search(sentence):
+        score = score + 1.5 if pregnant else score * 0.3
+    return score
+
+
+def compact_label(label: Dict[str, Any], age_bucket: str, pregnant: bool, budget: int = LABEL_TOKEN_BUDGET) -> CompactLabel:
+    """
+    Label text for the translation prompt: empty sections are dropped, sentences that
+    repeat (boilerplate shared by several sections) are kept once, and when the text is
+    over `budget` tokens the sentences most relevant to the user's age and pregnancy
+    status are kept, earlier sentences of the more important sections first. Kept
+    sentences stay in label order.
+    """
+    original = format_label(label)
+    titles: Dict[str, str] = {}
+    # (section, sentence, score) in label order.
+    sentences: List[Tuple[str, str, float]] = []
+    seen = set()
+    for field, title, weight in LABEL_SECTIONS:
+        text = label_field(label, field)
+        position = 0
+        for sentence in split_sentences(text):
+            sentence = " ".join(sentence.split())
+            key = " ".join(tokenize(sentence))
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            titles[field] = title
+            # The title counts too: "Pregnancy or Breastfeeding: Ask a health professional".
+            relevance = _relevance(f"{title}: {sentence}", age_bucket, pregnant)
+            sentences.append((field, sentence, weight / (1 + 0.15 * position) * relevance))
+            position += 1
+
+    counts = count_tokens([original] + [sentence for _, sentence, _ in sentences] + [f"{title}: " for title in titles.values()])
+    original_tokens, sentence_tokens = counts[0], counts[1:len(sentences) + 1]
+    title_tokens = dict(zip(titles, counts[len(sentences) + 1:]))
+
+    keep = set(range(len(sentences)))
+    if budget > 0 and sum(sentence_tokens) + sum(title_tokens.values()) > budget:
+        keep, used, included = set(), 0, set()
+        for i in sorted(range(len(sentences)), key=lambda i: -sentences[i][2]):
+            field = sentences[i][0]
+            cost = sentence_tokens[i] + (0 if field in included else title_tokens[field])
+            if used + cost <= budget:
+                keep.add(i)
+                included.add(field)
+                used += cost
+
+    sections: Dict[str, List[str]] = {}
+    for i, (field, sentence, _) in enumerate(sentences):
+        if i in keep:
+            sections.setdefault(field, []).append(sentence)
+    text = "\n".join(f"{titles[field]}: {' '.join(kept)}" for field, kept in sections.items())
+    compacted = CompactLabel(text, original_tokens, count_tokens([text])[0])
+    # Labels are compacted in worker threads.
+    with _stats_lock:
+        compaction_stats["labels"] += 1
+        compaction_stats["original_tokens"] += compacted.original_tokens
+        compaction_stats["tokens"] += compacted.tokens
+        compaction_stats["tokens_saved"] += compacted.tokens_saved
+    return compacted
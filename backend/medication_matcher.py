@@ -1,113 +1,486 @@
-from typing import List, Optional
+import importlib.util
+import os
+import pickle
+import sys
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from rapidfuzz import process, fuzz
+from rapidfuzz import process, fuzz, utils
 
-class MedicationVector:
-    def __init__(self, name: str):
-        self.name = name
+# Length of the character n-grams used by the candidate index.
+NGRAM_SIZE = 3
+# Number of names scored up front to establish the top-k score threshold.
+SEED_CANDIDATES = 64
+# Slack for comparing float64 bounds with RapidFuzz's float32 scores.
+SCORE_EPSILON = 1e-3
+# Threads used by process.cdist when scoring a batch of queries (-1 = all cores).
+MATCHER_WORKERS = int(os.getenv("MATCHER_WORKERS", "1"))
+# Set to force the exhaustive fuzz.ratio scan (useful to verify the index).
+MATCHER_EXHAUSTIVE = os.getenv("MATCHER_EXHAUSTIVE", "").lower() in ("1", "true", "yes")
 
-class MedicationVector:
-    def __init__(self, name: str):
-        self.name = name
+# Catalog embeddings: an (n, dim) .npy matrix of L2-normalized float32 rows (or int8 rows
+# scaled by EMBEDDING_INT8_SCALE) and a names file holding the name of each row, one per line.
+EMBEDDINGS_PATH = os.getenv("EMBEDDINGS_PATH", "medication_embeddings.npy")
+EMBEDDINGS_NAMES_PATH = os.getenv("EMBEDDINGS_NAMES_PATH", os.path.splitext(EMBEDDINGS_PATH)[0] + ".names.txt")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_INT8_SCALE = 127.0
+# Rows multiplied at a time, which bounds the float32 copy made of int8 blocks.
+EMBEDDING_BLOCK_ROWS = 65536
+# Weight of the cosine similarity (scaled to 0-100) in the fused score, the rest goes to
+# fuzz.ratio. 0 keeps the matcher purely lexical and never loads the model.
+MATCHER_SEMANTIC_WEIGHT = float(os.getenv("MATCHER_SEMANTIC_WEIGHT", "0"))
+# Candidates taken from each side, per requested match, before fusing the scores.
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "10"))
+# Bumped whenever the pickled layout of MedicationIndex changes; older snapshots are ignored.
+SNAPSHOT_FORMAT = 1
 
-def load_medication_vectors(csv_file: str) -> List[MedicationVector]:
-    import csv
-    medication_vectors = []
-    try:
-        with open(csv_file, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if row and row[0].strip():
-                    medication_vectors.append(MedicationVector(row[0].strip()))
-        print(f"Loaded {len(medication_vectors)} medication names from CSV.")
-    except Exception as e:
-        print("Error loading CSV file:", e)
-    return medication_vectors
+def _strings_nbytes(strings: Iterable[str]) -> int:
+    # Each distinct str object is counted once (shared objects are free).
+    return sum(sys.getsizeof(s) for s in {id(s): s for s in strings}.values())
 
-def find_closest_medications(query: str, medication_vectors: List[MedicationVector], k: int = 3) -> List[str]:
+class MedicationCatalog:
     """
-    Uses RapidFuzz to calculate the lexical similarity (using fuzz.ratio) between the query
-    and each medication name, returning the top k closest matches.
+    Immutable, array-backed list of medication names.
+
+    Names live in a single read-only object array (one pointer per name) that
+    RapidFuzz consumes directly, next to their lowercase forms and lengths, so
+    matching never copies the catalog. Active ingredients, when the catalog was
+    built from the NDC product file, are kept by lowercase name.
     """
-    names = [med.name for med in medication_vectors]
-    
-    matches = process.extract(query, names, scorer=fuzz.ratio, limit=k)
+    __slots__ = ("names", "normalized", "lengths", "ingredients")
+
+    def __init__(self, names: Iterable[str], ingredients: Optional[Dict[str, Tuple[str, ...]]] = None):
+        names = list(names)
+        self.ingredients = ingredients or {}
+        self.names = np.array(names, dtype=object)
+        # Reuse the original object when a name is already lowercase.
+        lowered = (name.lower() for name in names)
+        self.normalized = np.array([low if low != name else name for low, name in zip(lowered, names)], dtype=object)
+        self.lengths = np.fromiter((len(name) for name in names), dtype=np.int32, count=len(names))
+        self._freeze()
+
+    def _freeze(self):
+        for array in (self.names, self.normalized, self.lengths):
+            array.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, idx: int) -> str:
+        return self.names[idx]
 
-    return [match for match, score, index in matches]
+    def memory_report(self) -> Dict[str, int]:
+        """
+        Approximate heap usage in bytes, per component.
+        """
+        return {
+            "names": self.names.nbytes + _strings_nbytes(self.names),
+            "normalized": self.normalized.nbytes + _strings_nbytes(
+                name for name, original in zip(self.normalized, self.names) if name is not original
+            ),
+            "lengths": self.lengths.nbytes,
+            "ingredients": sys.getsizeof(self.ingredients) + sum(
+                sys.getsizeof(values) + _strings_nbytes(values) for values in self.ingredients.values()
+            ),
+        }
 
-# Cache for fast processing
-_cached_medication_vectors: Optional[List[MedicationVector]] = None
+def format_memory_report(report: Dict[str, int]) -> str:
+    total = sum(report.values())
+    parts = ", ".join(f"{key} {value / 1e6:.1f} MB" for key, value in report.items())
+    return f"{total / 1e6:.1f} MB ({parts})"
 
-async def get_medication_vectors_from_db(db: AsyncIOMotorDatabase) -> List[MedicationVector]:
+def _ngram_counts(text: str, n: int = NGRAM_SIZE) -> Counter:
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+def _build_postings(names: Sequence[str], n: int) -> Tuple[Dict[str, int], np.ndarray, np.ndarray, np.ndarray]:
     """
-    Asynchronously retrieves all medication documents from the "medications" collection,
-    converting each document into a MedicationVector. Result is cached forever.
+    Inverted index in CSR form: the postings of the gram with slot s are
+    ids[offsets[s]:offsets[s + 1]] (name indices) and counts[...] (occurrences).
     """
-    global _cached_medication_vectors
-    if _cached_medication_vectors is not None:
-        return _cached_medication_vectors
+    slots: Dict[str, int] = {}
+    gram_slots: List[int] = []
+    ids: List[int] = []
+    counts: List[int] = []
+    for idx, name in enumerate(names):
+        for gram, count in _ngram_counts(name, n).items():
+            gram_slots.append(slots.setdefault(gram, len(slots)))
+            ids.append(idx)
+            counts.append(count)
+    gram_slots = np.array(gram_slots, dtype=np.int32)
+    order = np.argsort(gram_slots, kind="stable")
+    offsets = np.zeros(len(slots) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(gram_slots, minlength=len(slots)), out=offsets[1:])
+    return (
+        slots,
+        offsets,
+        np.array(ids, dtype=np.int32)[order],
+        np.minimum(np.array(counts, dtype=np.int32)[order], 255).astype(np.uint8),
+    )
 
-    medication_vectors = []
-    # Use a projection to fetch only the 'name' field.
-    cursor = db["medications"].find({}, {"name": 1})
-    async for doc in cursor:
-        name = doc.get("name")
-        if name:
-            medication_vectors.append(MedicationVector(name))
-    _cached_medication_vectors = medication_vectors
-    print(f"Cached {_cached_medication_vectors.__len__()} medication names from MongoDB.")
-    return medication_vectors
+class EmbeddingMatrix:
+    """
+    Catalog embeddings memory-mapped from a .npy file.
 
+    The pages are shared through the OS page cache, so every worker on the host
+    reads the same copy of the matrix. Rows are normalized ahead of time, so the
+    cosine similarity of a query with every name is one matrix product.
+    """
 
-'''
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import List, Optional
-from motor.motor_asyncio import AsyncIOMotorDatabase
+    def __init__(self, path: str = EMBEDDINGS_PATH, names_path: str = EMBEDDINGS_NAMES_PATH):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.matrix = np.load(path, mmap_mode="r")
+        if self.matrix.ndim != 2 or self.matrix.dtype not in (np.float32, np.int8):
+            raise ValueError(f"{path} must hold a 2-d float32 or int8 array, got {self.matrix.dtype} {self.matrix.shape}")
+        self.scale = 1.0 / EMBEDDING_INT8_SCALE if self.matrix.dtype == np.int8 else 1.0
+        with open(names_path, "r", encoding="utf-8") as f:
+            names = f.read().split("\n")
+        if names and names[-1] == "":
+            names.pop()
+        if len(names) != len(self.matrix):
+            raise ValueError(f"{names_path} has {len(names)} names for {len(self.matrix)} embeddings")
+        self.rows = {name: row for row, name in enumerate(names)}
 
-class MedicationVector:
-    def __init__(self, name: str, vector: np.ndarray):
-        self.name = name
-        self.vector = vector
+    def __len__(self) -> int:
+        return len(self.matrix)
 
-def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-    return float(np.dot(vec1, vec2) / (norm1 * norm2))
+    def rows_for(self, names: Sequence[str]) -> np.ndarray:
+        """
+        Embedding row of every name, -1 for names that were not embedded.
+        """
+        return np.fromiter((self.rows.get(name, -1) for name in names), dtype=np.int64, count=len(names))
 
-def find_closest_medications(query: str, medication_vectors: List[MedicationVector], model, k: int = 3) -> List[str]:
-    query_embedding = model.encode(query)
-    similarities = []
-    for med in medication_vectors:
-        sim = cosine_similarity(query_embedding, med.vector)
-        similarities.append((med.name, sim))
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return [name for name, sim in similarities[:k]]
+    def similarities(self, query_vectors: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of each (normalized) query vector with every row.
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        scores = np.empty((len(query_vectors), len(self.matrix)), dtype=np.float32)
+        for start in range(0, len(self.matrix), EMBEDDING_BLOCK_ROWS):
+            block = self.matrix[start:start + EMBEDDING_BLOCK_ROWS]
+            np.matmul(query_vectors, block.T.astype(np.float32, copy=False), out=scores[:, start:start + len(block)])
+        if self.scale != 1.0:
+            scores *= self.scale
+        return scores
 
+_embeddings: Optional[EmbeddingMatrix] = None
+_encoder = None
+_encoder_lock = threading.Lock()
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
-# Cache
-_cached_medication_vectors: Optional[List[MedicationVector]] = None
+def load_embeddings(path: str = EMBEDDINGS_PATH, names_path: str = EMBEDDINGS_NAMES_PATH) -> Optional[EmbeddingMatrix]:
+    """
+    The process-wide EmbeddingMatrix, reopened when the file has been rewritten.
+    Returns None when semantic matching is disabled or unavailable.
+    """
+    global _embeddings
+    if MATCHER_SEMANTIC_WEIGHT <= 0:
+        return None
+    if importlib.util.find_spec("sentence_transformers") is None:
+        print("sentence-transformers is not installed, using lexical matching only.")
+        return None
+    try:
+        if _embeddings is None or _embeddings.path != path or _embeddings.mtime != os.path.getmtime(path):
+            _embeddings = EmbeddingMatrix(path, names_path)
+    except (OSError, ValueError) as e:
+        print("Could not load medication embeddings, using lexical matching only:", e)
+        return None
+    return _embeddings
+
+def encode_queries(queries: Sequence[str]) -> np.ndarray:
+    """
+    Normalized float32 embeddings of the queries, loading the model on first use.
+    """
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            from sentence_transformers import SentenceTransformer
+            _encoder = SentenceTransformer(EMBEDDING_MODEL)
+    vectors = _encoder.encode(list(queries), convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32)
 
-async def get_medication_vectors_from_db(db: AsyncIOMotorDatabase) -> List[MedicationVector]:
+class MedicationIndex:
     """
-    Asynchronously retrieves all medication documents from the "medications" collection,
-    converting each document's vector field into a numpy array. Results are cached for subsequent calls.
+    Character n-gram inverted index over the medication names.
+
+    For every name we know its length and, per query, how many characters and
+    n-grams it shares with the query. From those numbers we derive an upper bound
+    on fuzz.ratio, so only names whose bound can still reach the current top-k are
+    actually scored. Results are identical to an exhaustive
+    process.extract(query, names, scorer=fuzz.ratio).
+
+    With an EmbeddingMatrix attached, hybrid_search_many fuses fuzz.ratio with the
+    cosine similarity of the names' embeddings.
     """
-    global _cached_medication_vectors
-    if _cached_medication_vectors is not None:
-        return _cached_medication_vectors
 
-    medication_vectors = []
-    # Use projection to only retrieve 'name' and 'vector'
-    cursor = db["medications"].find({}, {"name": 1, "vector": 1}).batch_size(1000)
+    def __init__(self, catalog: MedicationCatalog, n: int = NGRAM_SIZE, embeddings: Optional[EmbeddingMatrix] = None):
+        self.n = n
+        self.catalog = catalog
+        self.names = catalog.names
+        self.lengths = catalog.lengths
+        # Per-character counts are dense (every name contains common letters),
+        # n-gram postings are sparse.
+        alphabet = sorted({char for name in self.names for char in name})
+        self.char_rows = {char: row for row, char in enumerate(alphabet)}
+        self.char_counts = np.zeros((len(alphabet), len(self.names)), dtype=np.uint8)
+        for idx, name in enumerate(self.names):
+            for char, count in Counter(name).items():
+                self.char_counts[self.char_rows[char], idx] = min(count, 255)
+        self.gram_slots, self.gram_offsets, self.posting_ids, self.posting_counts = _build_postings(self.names, n)
+        self.attach_embeddings(embeddings)
+
+    def attach_embeddings(self, embeddings: Optional[EmbeddingMatrix]):
+        self.embeddings = embeddings
+        if embeddings is not None:
+            rows = embeddings.rows_for(self.names)
+            # Catalog positions that have an embedding, and their rows in the matrix.
+            self.embedded_ids = np.flatnonzero(rows >= 0)
+            self.embedded_rows = rows[self.embedded_ids]
+
+    def __getstate__(self):
+        # The memory-mapped embeddings are not part of a snapshot; they are reattached on load.
+        state = self.__dict__.copy()
+        for key in ("embeddings", "embedded_ids", "embedded_rows"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.embeddings = None
+        self.catalog._freeze()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _shared_chars(self, query: str) -> np.ndarray:
+        shared = np.zeros(len(self.names), dtype=np.uint16)
+        for char, count in Counter(query).items():
+            row = self.char_rows.get(char)
+            if row is not None:
+                shared += np.minimum(self.char_counts[row], min(count, 255))
+        return shared
+
+    def _shared_grams(self, query: str) -> np.ndarray:
+        shared = np.zeros(len(self.names), dtype=np.int32)
+        for gram, count in _ngram_counts(query, self.n).items():
+            slot = self.gram_slots.get(gram)
+            if slot is not None:
+                start, end = self.gram_offsets[slot], self.gram_offsets[slot + 1]
+                shared[self.posting_ids[start:end]] += np.minimum(self.posting_counts[start:end], count)
+        return shared
+
+    def upper_bounds(self, query: str) -> np.ndarray:
+        """
+        Upper bound of fuzz.ratio(query, name) for every name in the index.
+
+        fuzz.ratio is 100 * 2 * lcs / (len1 + len2), and equivalently
+        100 * (1 - d / (len1 + len2)) with d the Indel distance. The longest common
+        subsequence cannot use more of a character than both strings contain, and
+        since d bounds the Levenshtein distance from above, the q-gram lemma gives
+        d >= (max(len1, len2) - n + 1 - shared) / n.
+        """
+        n = self.n
+        query_len = len(query)
+        scale = 100.0 / np.maximum(self.lengths + query_len, 1)
+        char_bound = 2.0 * self._shared_chars(query) * scale
+        min_dist = np.maximum(
+            np.abs(self.lengths - query_len),
+            -((self._shared_grams(query) - np.maximum(self.lengths, query_len) + n - 1) // n),
+        )
+        return np.minimum(char_bound, 100.0 - min_dist * scale)
+
+    def search(self, query: str, k: int) -> List[str]:
+        return self.search_many([(query, k)])[0]
+
+    def search_many(self, queries: Sequence[Tuple[str, int]]) -> List[List[str]]:
+        """
+        Top-k names for several (query, k) pairs at once. Each round scores the
+        union of every query's candidates with a single process.cdist call.
+        """
+        return [list(self.names[ids]) for ids in self._search_ids_many(queries)]
+
+    def _search_ids_many(self, queries: Sequence[Tuple[str, int]]) -> List[np.ndarray]:
+        results = [np.empty(0, dtype=np.int64) for _ in queries]
+        active = [(pos, query, min(k, len(self.names))) for pos, (query, k) in enumerate(queries) if k > 0 and len(self.names)]
+        if not active:
+            return results
+        texts = [query for _, query, _ in active]
+        bounds = [self.upper_bounds(query) for query in texts]
+        # First round: score the names with the best bounds to get, per query, a
+        # threshold that its k-th best score is guaranteed to reach.
+        seeded = np.zeros(len(self.names), dtype=bool)
+        for (_, _, k), bound in zip(active, bounds):
+            seed_size = min(len(self.names), max(SEED_CANDIDATES, k))
+            seeded[np.argpartition(-bound, seed_size - 1)[:seed_size]] = True
+        seed_ids = np.flatnonzero(seeded)
+        seed_scores = self._score(texts, seed_ids)
+        # Second round: only names whose bound can still reach the threshold
+        # may belong to the top-k (ties included, so index order is preserved).
+        pending = np.zeros(len(self.names), dtype=bool)
+        for row, ((_, _, k), bound) in enumerate(zip(active, bounds)):
+            threshold = np.partition(seed_scores[row], len(seed_ids) - k)[len(seed_ids) - k]
+            pending |= bound >= threshold - SCORE_EPSILON
+        pending[seeded] = False
+        rest_ids = np.flatnonzero(pending)
+        ids = np.concatenate((seed_ids, rest_ids))
+        scores = np.hstack((seed_scores, self._score(texts, rest_ids)))
+        for row, (pos, _, k) in enumerate(active):
+            results[pos] = self._top_k(ids, scores[row], k)
+        return results
+
+    def exhaustive_search_many(self, queries: Sequence[Tuple[str, int]]) -> List[List[str]]:
+        results: List[List[str]] = [[] for _ in queries]
+        active = [(pos, query, min(k, len(self.names))) for pos, (query, k) in enumerate(queries) if k > 0 and len(self.names)]
+        if not active:
+            return results
+        scores = self._score([query for _, query, _ in active], None)
+        ids = np.arange(len(self.names))
+        for row, (pos, _, k) in enumerate(active):
+            results[pos] = list(self.names[self._top_k(ids, scores[row], k)])
+        return results
+
+    def hybrid_search_many(self, queries: Sequence[Tuple[str, int]], semantic_weight: float = MATCHER_SEMANTIC_WEIGHT) -> List[List[str]]:
+        """
+        Top-k names by semantic_weight * 100 * cosine + (1 - semantic_weight) * fuzz.ratio.
+
+        The candidates of a query are its best HYBRID_CANDIDATE_FACTOR * k names on
+        each side: the lexical ones come from the n-gram index, the semantic ones from
+        one matrix product over all embeddings followed by argpartition. Names without
+        an embedding have a cosine of 0.
+        """
+        if self.embeddings is None:
+            return self.search_many(queries)
+        results: List[List[str]] = [[] for _ in queries]
+        active = [(pos, query, min(k, len(self.names))) for pos, (query, k) in enumerate(queries) if k > 0 and len(self.names)]
+        if not active:
+            return results
+        texts = [query for _, query, _ in active]
+        pools = [min(len(self.names), k * HYBRID_CANDIDATE_FACTOR) for _, _, k in active]
+        lexical_ids = self._search_ids_many(list(zip(texts, pools)))
+        similarities = self.embeddings.similarities(encode_queries(texts))
+        semantic = np.zeros(len(self.names), dtype=np.float32)
+        for row, (pos, query, k) in enumerate(active):
+            semantic[self.embedded_ids] = similarities[row, self.embedded_rows] * 100.0
+            pool = pools[row]
+            semantic_ids = np.argpartition(-semantic, pool - 1)[:pool]
+            ids = np.union1d(lexical_ids[row], semantic_ids)
+            fused = (1.0 - semantic_weight) * self._score([query], ids)[0] + semantic_weight * semantic[ids]
+            results[pos] = list(self.names[self._top_k(ids, fused, k)])
+        return results
+
+    def _top_k(self, ids: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+        # Same order as process.extract: best score first, lower index on ties.
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = np.flatnonzero(scores >= threshold)
+        order = np.lexsort((ids[keep], -scores[keep]))[:k]
+        return ids[keep][order]
+
+    def _score(self, queries: List[str], ids: Optional[np.ndarray]) -> np.ndarray:
+        choices = self.names if ids is None else self.names[ids]
+        if len(choices) == 0:
+            return np.empty((len(queries), 0), dtype=np.float32)
+        return process.cdist(queries, choices, scorer=fuzz.ratio, workers=MATCHER_WORKERS)
+
+    def memory_report(self) -> Dict[str, int]:
+        """
+        Approximate heap usage in bytes of the catalog plus the index structures.
+        """
+        report = self.catalog.memory_report()
+        report["char_counts"] = self.char_counts.nbytes
+        report["postings"] = (
+            self.gram_offsets.nbytes + self.posting_ids.nbytes + self.posting_counts.nbytes
+            + sys.getsizeof(self.gram_slots) + _strings_nbytes(self.gram_slots)
+        )
+        if self.embeddings is not None:
+            # The matrix itself is memory-mapped and shared, only the row mapping is private.
+            report["embedding_rows"] = self.embedded_ids.nbytes + self.embedded_rows.nbytes
+        return report
+
+    def exhaustive_search(self, query: str, k: int) -> List[str]:
+        matches = process.extract(query, self.names, scorer=fuzz.ratio, limit=k)
+        return [match for match, score, index in matches]
+
+def _search_many(index: MedicationIndex, queries: Sequence[Tuple[str, int]], exhaustive: bool) -> List[List[str]]:
+    if exhaustive:
+        return index.exhaustive_search_many(queries)
+    if index.embeddings is not None and MATCHER_SEMANTIC_WEIGHT > 0:
+        return index.hybrid_search_many(queries)
+    return index.search_many(queries)
+
+def build_medication_index(catalog: MedicationCatalog) -> MedicationIndex:
+    """
+    Builds the index and attaches the catalog embeddings when semantic matching is on.
+    """
+    return MedicationIndex(catalog, embeddings=load_embeddings())
+
+def save_index_snapshot(index: MedicationIndex, path: str, version=None):
+    """
+    Pickles the index (without its embeddings) to `path`, replacing any previous snapshot
+    atomically so that concurrent workers never read a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"format": SNAPSHOT_FORMAT, "ngram_size": index.n, "version": version, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_index_snapshot(path: str) -> Optional[Tuple[object, MedicationIndex]]:
+    """
+    Returns (catalog version, index) from a snapshot written by save_index_snapshot, or
+    None if there is none or it was written by an incompatible version of this module.
+    Snapshots are pickles: only load files this service wrote itself.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+    if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("ngram_size") != NGRAM_SIZE:
+        return None
+    index = snapshot["index"]
+    index.attach_embeddings(load_embeddings())
+    return snapshot["version"], index
+
+def find_closest_medications_batch(
+    queries: Sequence[Tuple[str, int]],
+    medication_index: MedicationIndex,
+    exhaustive: bool = MATCHER_EXHAUSTIVE,
+) -> List[str]:
+    """
+    Runs several (query, k) lookups in one pass over the catalog and returns their
+    results concatenated in query order, with duplicates removed.
+    """
+    results = _search_many(medication_index, queries, exhaustive)
+    return list(dict.fromkeys(name for names in results for name in names))
+
+def best_match(queries: Sequence[str], candidates: Sequence[str]) -> Optional[str]:
+    """
+    The candidate that best matches any of the queries (e.g. the OCR text and its
+    prefixes), ignoring case and punctuation. On equal scores the longer name wins: for
+    "Tylenol PM Extra Strength", "Tylenol PM Extra Strength" and "Tylenol" both match a
+    query fully, and the longer one is the more specific product.
+    """
+    if not candidates:
+        return None
+    scores = process.cdist(queries, candidates, scorer=fuzz.ratio, processor=utils.default_process).max(axis=0)
+    return max(zip(scores, candidates), key=lambda item: (item[0], len(item[1])))[1]
+
+async def fetch_medication_catalog(db: AsyncIOMotorDatabase) -> MedicationCatalog:
+    """
+    Asynchronously retrieves all medication documents from the "medications" collection
+    into a MedicationCatalog. Caching and refreshing is handled by catalog_cache.
+    """
+    names = []
+    ingredients = {}
+    # Use a projection to fetch only the fields the matcher and the precheck need.
+    cursor = db["medications"].find({}, {"name": 1, "ingredients": 1, "_id": 0}).batch_size(10000)
     async for doc in cursor:
         name = doc.get("name")
-        vector = doc.get("vector")
-        if name and vector:
-            medication_vectors.append(MedicationVector(name, np.array(vector, dtype=np.float32)))
-    _cached_medication_vectors = medication_vectors
-    return medication_vectors
-'''
\ No newline at end of file
+        if name:
+            names.append(name)
+            if doc.get("ingredients"):
+                ingredients[name.lower()] = tuple(doc["ingredients"])
+    return MedicationCatalog(names, ingredients)
+
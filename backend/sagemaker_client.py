@@ -1,5 +1,35 @@
+import asyncio
+import contextvars
 import json
-from config import sagemaker_runtime, ENDPOINT_NAME
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from config import create_sagemaker_runtime, ENDPOINT_NAME, SAGEMAKER_MAX_IN_FLIGHT, SAGEMAKER_TIMEOUT_SECONDS
+from instrumentation import record, span
+
+sagemaker_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_runtime():
+    """
+    The sagemaker-runtime client of this worker, built on first use (or by the app's
+    startup warmup) and shared by the invocation threads.
+    """
+    global sagemaker_runtime
+    if sagemaker_runtime is None:
+        with _runtime_lock:
+            if sagemaker_runtime is None:
+                sagemaker_runtime = create_sagemaker_runtime()
+    return sagemaker_runtime
+
+def set_runtime(runtime) -> None:
+    """
+    Replaces the sagemaker-runtime client, e.g. with sagemaker_fake.FakeSageMakerRuntime in tests.
+    """
+    global sagemaker_runtime
+    sagemaker_runtime = runtime
 
 def generate_response(prompt: str, max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6) -> str:
     payload = {
@@ -11,11 +41,238 @@ def generate_response(prompt: str, max_new_tokens: int = 256, top_p: float = 0.9
         }
     }
     
-    response = sagemaker_runtime.invoke_endpoint(
+    with span("sagemaker_invoke"):
+        response = get_runtime().invoke_endpoint(
+            EndpointName=ENDPOINT_NAME,
+            Body=json.dumps(payload),
+            ContentType="application/json"
+        )
+        # The response Body is a stream; read and decode it.
+        result = response['Body'].read().decode('utf-8')
+    with span("json_decode"):
+        return json.loads(result)
+
+def generate_batch(prompts: List[str], max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6) -> List[Any]:
+    """
+    Sends several prompts with the same sampling parameters as one request. Needs a
+    container that accepts a list of inputs (e.g. LMI/DJL); returns one
+    {"generated_text": ...} result per prompt, in order.
+    """
+    payload = {
+        "inputs": prompts,
+        "parameters": {
+            "max_new_tokens": max_new_tokens,
+            "top_p": top_p,
+            "temperature": temperature
+        }
+    }
+    with span("sagemaker_invoke"):
+        response = get_runtime().invoke_endpoint(
+            EndpointName=ENDPOINT_NAME,
+            Body=json.dumps(payload),
+            ContentType="application/json"
+        )
+        body = response['Body'].read().decode('utf-8')
+    with span("json_decode"):
+        results = json.loads(body)
+    if isinstance(results, dict):
+        # Some containers answer {"generated_text": [...]} instead of a list of objects.
+        results = results.get("generated_text", [])
+    if not isinstance(results, list) or len(results) != len(prompts):
+        raise ValueError(f"Batched response has {len(results) if isinstance(results, list) else 'no'} results for {len(prompts)} prompts")
+    return [result if isinstance(result, dict) else {"generated_text": result} for result in results]
+
+def _parse_stream_line(line: bytes) -> Optional[str]:
+    """
+    Extracts the token text from one line of a TGI/LMI response stream,
+    e.g. b'data:{"token": {"text": " Take", "special": false}}'.
+    """
+    line = line.strip()
+    if line.startswith(b"data:"):
+        line = line[5:].strip()
+    if not line:
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    token = event.get("token")
+    if isinstance(token, dict):
+        return None if token.get("special") else token.get("text")
+    outputs = event.get("outputs")
+    if isinstance(outputs, list) and outputs:
+        return outputs[0]
+    return None
+
+def stream_response(prompt: str, max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6, stop: Optional[Any] = None) -> Iterator[str]:
+    """
+    Yields generated tokens as they arrive from invoke_endpoint_with_response_stream.
+    `stop` is an optional threading.Event used to abandon the stream early.
+    """
+    payload = {
+        "inputs": prompt,
+        "parameters": {
+            "max_new_tokens": max_new_tokens,
+            "top_p": top_p,
+            "temperature": temperature
+        },
+        "stream": True
+    }
+    response = get_runtime().invoke_endpoint_with_response_stream(
         EndpointName=ENDPOINT_NAME,
         Body=json.dumps(payload),
         ContentType="application/json"
     )
-    # The response Body is a stream; read and decode it.
-    result = response['Body'].read().decode('utf-8')
-    return json.loads(result)
+    buffer = b""
+    # PayloadPart boundaries do not line up with lines, so buffer until a newline.
+    for event in response["Body"]:
+        if stop is not None and stop.is_set():
+            return
+        part = event.get("PayloadPart")
+        if not part:
+            continue
+        buffer += part["Bytes"]
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            token = _parse_stream_line(line)
+            if token:
+                yield token
+    token = _parse_stream_line(buffer)
+    if token:
+        yield token
+
+# boto3 is blocking, so invocations run on a dedicated pool sized to the in-flight limit;
+# they never compete with asyncio.to_thread work (matching) for the default executor.
+_executor = ThreadPoolExecutor(max_workers=SAGEMAKER_MAX_IN_FLIGHT, thread_name_prefix="sagemaker")
+_semaphore: Optional[asyncio.Semaphore] = None
+_latencies = deque(maxlen=1000)
+_metrics: Dict[str, Any] = {
+    "queued": 0,
+    "in_flight": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "queue_wait_seconds_total": 0.0,
+}
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(SAGEMAKER_MAX_IN_FLIGHT)
+    return _semaphore
+
+def _release(semaphore: asyncio.Semaphore, started: float, future) -> None:
+    # Runs when the invocation thread finishes, even if the caller already timed out,
+    # so the in-flight limit always reflects the real number of open invocations.
+    semaphore.release()
+    _metrics["in_flight"] -= 1
+    if future.cancelled() or future.exception() is not None:
+        _metrics["failed"] += 1
+    else:
+        _metrics["completed"] += 1
+        _latencies.append(time.perf_counter() - started)
+
+async def _run_limited(fn, *args, timeout: float = SAGEMAKER_TIMEOUT_SECONDS):
+    semaphore = _get_semaphore()
+    queued_at = time.perf_counter()
+    _metrics["queued"] += 1
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        _metrics["timeouts"] += 1
+        raise
+    finally:
+        _metrics["queued"] -= 1
+    started = time.perf_counter()
+    _metrics["queue_wait_seconds_total"] += started - queued_at
+    record("sagemaker_queue", started - queued_at)
+    _metrics["in_flight"] += 1
+    # Run with the caller's context so spans in the thread count towards its request.
+    future = asyncio.get_running_loop().run_in_executor(_executor, contextvars.copy_context().run, fn, *args)
+    future.add_done_callback(lambda f: _release(semaphore, started, f))
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), max(timeout - (started - queued_at), 0))
+    except asyncio.TimeoutError:
+        _metrics["timeouts"] += 1
+        raise
+
+async def generate_response_async(prompt: str, max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6, timeout: float = SAGEMAKER_TIMEOUT_SECONDS) -> str:
+    """
+    Runs generate_response off the event loop, with at most SAGEMAKER_MAX_IN_FLIGHT
+    concurrent invocations per worker. Raises asyncio.TimeoutError after `timeout` seconds.
+    """
+    return await _run_limited(generate_response, prompt, max_new_tokens, top_p, temperature, timeout=timeout)
+
+async def generate_batch_async(prompts: List[str], max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6, timeout: float = SAGEMAKER_TIMEOUT_SECONDS) -> List[Any]:
+    """
+    Async generate_batch; a whole batch occupies a single in-flight slot.
+    """
+    return await _run_limited(generate_batch, prompts, max_new_tokens, top_p, temperature, timeout=timeout)
+
+async def stream_response_async(prompt: str, max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6, timeout: float = SAGEMAKER_TIMEOUT_SECONDS) -> AsyncIterator[str]:
+    """
+    Async iterator over the tokens of a streamed generation. Shares the in-flight limit
+    with generate_response_async; `timeout` bounds the wait for each next token.
+    """
+    semaphore = _get_semaphore()
+    queued_at = time.perf_counter()
+    _metrics["queued"] += 1
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        _metrics["timeouts"] += 1
+        raise
+    finally:
+        _metrics["queued"] -= 1
+    _metrics["in_flight"] += 1
+    started = time.perf_counter()
+    record("sagemaker_queue", started - queued_at)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            with span("sagemaker_stream"):
+                for token in stream_response(prompt, max_new_tokens, top_p, temperature, stop):
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+            raise
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    future = loop.run_in_executor(_executor, contextvars.copy_context().run, produce)
+    future.add_done_callback(lambda f: _release(semaphore, started, f))
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                _metrics["timeouts"] += 1
+                raise
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Client went away or we timed out: tell the producer thread to stop reading.
+        stop.set()
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 3)
+
+def invocation_stats() -> Dict[str, Any]:
+    latencies = list(_latencies)
+    return {
+        **_metrics,
+        "max_in_flight": SAGEMAKER_MAX_IN_FLIGHT,
+        "latency_p50_seconds": _percentile(latencies, 0.5),
+        "latency_p95_seconds": _percentile(latencies, 0.95),
+        "latency_p99_seconds": _percentile(latencies, 0.99),
+    }
@@ -0,0 +1,64 @@
+import io
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+
+class FakeSageMakerRuntime:
+    """
+    In-process stand-in for the boto3 sagemaker-runtime client, for tests and benchmarks.
+
+    invoke_endpoint sleeps for the configured latency and returns {"generated_text": ...};
+    a list of inputs (LMI-style batch) returns one result per input and takes
+    batch_item_latency longer per extra prompt. invoke_endpoint_with_response_stream
+    emits the same text token by token as TGI/LMI-style "data:{...}" lines, split across
+    PayloadPart events. `capacity` limits how many requests the fake serves at once
+    (like a single GPU instance); None means unlimited.
+    """
+
+    def __init__(self, latency: float = 0.5, token_latency: float = 0.01, text: str = "- This is a fake bullet point.\n- This is another one.", batch_item_latency: float = 0.02, capacity: Optional[int] = None):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.batch_item_latency = batch_item_latency
+        self.text = text
+        self.invocations = 0
+        self._capacity = threading.BoundedSemaphore(capacity) if capacity else None
+
+    def _tokens(self, max_new_tokens: int):
+        return [word + " " for word in self.text.split(" ")][:max_new_tokens]
+
+    def invoke_endpoint(self, EndpointName: str, Body: str, ContentType: str = "application/json", **kwargs) -> Dict[str, Any]:
+        self.invocations += 1
+        payload = json.loads(Body)
+        max_new_tokens = payload.get("parameters", {}).get("max_new_tokens", 256)
+        inputs = payload["inputs"]
+        batch_size = len(inputs) if isinstance(inputs, list) else 1
+        self._busy(self.latency + self.batch_item_latency * (batch_size - 1))
+        result = {"generated_text": "".join(self._tokens(max_new_tokens))}
+        body = json.dumps([result] * batch_size if isinstance(inputs, list) else result).encode("utf-8")
+        return {"Body": io.BytesIO(body), "ContentType": "application/json"}
+
+    def _busy(self, seconds: float):
+        if self._capacity is None:
+            time.sleep(seconds)
+            return
+        with self._capacity:
+            time.sleep(seconds)
+
+    def invoke_endpoint_with_response_stream(self, EndpointName: str, Body: str, ContentType: str = "application/json", **kwargs) -> Dict[str, Any]:
+        self.invocations += 1
+        payload = json.loads(Body)
+        max_new_tokens = payload.get("parameters", {}).get("max_new_tokens", 256)
+        return {"Body": self._events(self._tokens(max_new_tokens)), "ContentType": "application/jsonlines"}
+
+    def _events(self, tokens) -> Iterator[Dict[str, Any]]:
+        # Time to first token is modelled as a fraction of the full latency.
+        time.sleep(self.latency / 4)
+        for token in tokens:
+            time.sleep(self.token_latency)
+            line = b"data:" + json.dumps({"token": {"text": token}}).encode("utf-8") + b"\n"
+            # Split each line in two parts to exercise the client's line buffering.
+            middle = len(line) // 2
+            yield {"PayloadPart": {"Bytes": line[:middle]}}
+            yield {"PayloadPart": {"Bytes": line[middle:]}}
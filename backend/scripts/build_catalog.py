@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Builds the medication catalog from the FDA NDC product file in one streaming pass.
+
+Reads product.csv, product.txt (tab separated) or the ndctext.zip download row by
+row and writes one document per proprietary name (compared case-insensitively,
+whitespace collapsed). A brand spans several formulations, so its generic names and
+active ingredients are merged over all of its rows; the name and product NDC are
+those of its first row. Memory is bounded by the names and their ingredients, not
+by the size of the file.
+
+Writes catalog.jsonl (one document per name) and catalog.delta.jsonl, the upserts
+and deletes against the previous catalog.jsonl, for bulk_load_medications.py --delta.
+
+    python build_catalog.py --input ndctext.zip
+    python bulk_load_medications.py --delta catalog.delta.jsonl
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+
+PRODUCT_MEMBERS = ("product.txt", "product.csv")
+
+
+def open_product_file(path, encoding):
+    """
+    Returns a text stream over the product rows and their delimiter.
+    """
+    if path.lower().endswith(".zip"):
+        archive = zipfile.ZipFile(path)
+        members = {os.path.basename(name).lower(): name for name in archive.namelist()}
+        member = next((members[name] for name in PRODUCT_MEMBERS if name in members), None)
+        if member is None:
+            raise SystemExit(f"{path} contains no product.txt or product.csv")
+        stream = io.TextIOWrapper(archive.open(member), encoding=encoding, errors="replace", newline="")
+        return stream, "\t" if member.lower().endswith(".txt") else ","
+    stream = open(path, "r", encoding=encoding, errors="replace", newline="")
+    return stream, "\t" if path.lower().endswith(".txt") else ","
+
+
+def normalize(value):
+    return " ".join((value or "").split())
+
+
+def add_unique(values, new_values):
+    # Appends the new non-empty values, compared case-insensitively, in order.
+    seen = {value.casefold() for value in values}
+    for value in new_values:
+        if value and value.casefold() not in seen:
+            seen.add(value.casefold())
+            values.append(value)
+
+
+def catalog_documents(rows):
+    """
+    One document per proprietary name, in order of first appearance. "Mucinex" is listed
+    as GUAIFENESIN and as DEXTROMETHORPHAN HYDROBROMIDE; GUAIFENESIN, so its ingredients
+    are both: the interaction precheck treats an ingredient list as complete.
+    """
+    documents = {}
+    for row in rows:
+        name = normalize(row.get("PROPRIETARYNAME"))
+        if not name:
+            continue
+        document = documents.get(name.casefold())
+        if document is None:
+            document = documents[name.casefold()] = {
+                "name": name,
+                "generic_names": [],
+                "ndc": normalize(row.get("PRODUCTNDC")),
+                "ingredients": [],
+            }
+        add_unique(document["generic_names"], [normalize(row.get("NONPROPRIETARYNAME"))])
+        add_unique(document["ingredients"], [normalize(part) for part in (row.get("SUBSTANCENAME") or "").split(";")])
+    return documents.values()
+
+
+def document_hash(line):
+    return hashlib.blake2b(line.encode("utf-8"), digest_size=16).digest()
+
+
+def read_previous(path):
+    # name key -> (hash of the stored line, name)
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                name = json.loads(line)["name"]
+                previous[name.casefold()] = (document_hash(line), name)
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the FDA NDC product file into catalog.jsonl plus a delta.")
+    parser.add_argument("--input", default="product.csv", help="product.csv, product.txt or the NDC zip download")
+    parser.add_argument("--output", default="catalog.jsonl")
+    parser.add_argument("--delta", default="catalog.delta.jsonl")
+    parser.add_argument("--encoding", default="utf-8")
+    args = parser.parse_args()
+
+    previous = read_previous(args.output)
+    stream, delimiter = open_product_file(args.input, args.encoding)
+    started = time.perf_counter()
+    rows = written = upserts = deletes = 0
+
+    def counted(reader):
+        nonlocal rows
+        for row in reader:
+            rows += 1
+            yield row
+
+    tmp_output = args.output + ".tmp"
+    with stream, open(tmp_output, "w", encoding="utf-8") as out, open(args.delta, "w", encoding="utf-8") as delta:
+        for document in catalog_documents(counted(csv.DictReader(stream, delimiter=delimiter))):
+            line = json.dumps(document, sort_keys=True)
+            out.write(line + "\n")
+            written += 1
+            known = previous.pop(document["name"].casefold(), None)
+            if known is not None and known[1] != document["name"]:
+                # The delta is applied by exact name: drop "Advil" when it became "ADVIL".
+                delta.write(json.dumps({"op": "delete", "name": known[1]}) + "\n")
+                deletes += 1
+            if known is None or known[0] != document_hash(line):
+                delta.write(json.dumps({"op": "upsert", "document": document}, sort_keys=True) + "\n")
+                upserts += 1
+        # Whatever is left in the previous build no longer exists.
+        for _, name in previous.values():
+            delta.write(json.dumps({"op": "delete", "name": name}) + "\n")
+        deletes += len(previous)
+    os.replace(tmp_output, args.output)
+
+    elapsed = time.perf_counter() - started
+    print(f"Read {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/sec): {written} unique names.")
+    print(f"Delta: {upserts} upserts, {deletes} deletes written to {args.delta}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Loads the medications collection without taking the live catalog offline.
+
+Documents are streamed from the source into a staging collection in unordered
+insert_many batches, the indexes are built there, and the staging collection is
+then renamed over "medications" (dropTarget) in one step. The API keeps serving
+the old catalog until the rename and reloads when the version document is bumped.
+
+    python bulk_load_medications.py --input catalog.jsonl
+    python bulk_load_medications.py --source embeddings --input medication_embeddings.npy
+    python bulk_load_medications.py --source csv --input names.csv
+    python bulk_load_medications.py --delta catalog.delta.jsonl
+    MONGO_URI=mongodb://localhost:27017 MONGO_TLS=0 python bulk_load_medications.py
+"""
+import argparse
+import csv
+import json
+import os
+import time
+import numpy as np
+import pymongo
+from dotenv import load_dotenv
+from pymongo import DeleteOne, ReplaceOne
+
+load_dotenv()
+MONGO_URI = os.environ.get("MONGO_URI")
+# Set MONGO_TLS=0 for a local mongod without TLS.
+MONGO_TLS = os.environ.get("MONGO_TLS", "1").lower() in ("1", "true", "yes")
+DB_NAME = "medilocate"
+COLLECTION_NAME = "medications"
+CATALOG_PATH = os.environ.get("CATALOG_PATH", "catalog.jsonl")
+
+
+def csv_documents(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                yield {"name": row[0].strip()}
+
+
+def catalog_documents(path):
+    # Output of build_catalog.py: one JSON document per line.
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def embedding_documents(path, catalog_path=CATALOG_PATH):
+    # Output of embed_catalog.py, read through a memory map one row at a time. The rest of
+    # each document (ingredients, generic name, NDC) comes from catalog.jsonl when it exists.
+    catalog = {}
+    if catalog_path and os.path.exists(catalog_path):
+        catalog = {document["name"]: document for document in catalog_documents(catalog_path)}
+    else:
+        print(f"{catalog_path} not found, loading names and vectors without ingredients.")
+    vectors = np.load(path, mmap_mode="r")
+    scale = 1.0 / 127.0 if vectors.dtype == np.int8 else 1.0
+    with open(os.path.splitext(path)[0] + ".names.txt", "r", encoding="utf-8") as f:
+        for name, vector in zip(f, vectors):
+            name = name.rstrip("\n")
+            yield {**catalog.get(name, {}), "name": name, "vector": (vector.astype(np.float32) * scale).tolist()}
+
+
+SOURCES = {
+    "csv": csv_documents,
+    "embeddings": embedding_documents,
+    "catalog": catalog_documents,
+}
+
+
+def batches(documents, size):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def connect(uri=MONGO_URI, tls=MONGO_TLS):
+    if not uri:
+        raise SystemExit("MONGO_URI is not set: export it or add it to the backend's .env file.")
+    if tls:
+        return pymongo.MongoClient(uri, tls=True, tlsAllowInvalidCertificates=True)
+    return pymongo.MongoClient(uri)
+
+
+def bump_catalog_version(db, collection_name=COLLECTION_NAME):
+    # Running API workers poll this document and reload their medication index.
+    db["catalog_meta"].update_one(
+        {"_id": collection_name},
+        {"$inc": {"version": 1}, "$currentDate": {"updated_at": True}},
+        upsert=True
+    )
+
+
+def bulk_load(db, documents, collection_name=COLLECTION_NAME, batch_size=5000):
+    """
+    Streams documents into <collection>_staging, indexes it and swaps it in.
+    Returns the number of inserted documents.
+    """
+    staging = db[f"{collection_name}_staging"]
+    staging.drop()
+    started = last_report = time.perf_counter()
+    inserted = 0
+    for batch in batches(documents, batch_size):
+        inserted += len(staging.insert_many(batch, ordered=False).inserted_ids)
+        now = time.perf_counter()
+        if now - last_report >= 1:
+            print(f"Inserted {inserted} rows ({inserted / (now - started):.0f} rows/sec)")
+            last_report = now
+    if not inserted:
+        staging.drop()
+        print("No documents to insert.")
+        return 0
+
+    staging.create_index("name")
+    staging.rename(collection_name, dropTarget=True)
+    bump_catalog_version(db, collection_name)
+    elapsed = time.perf_counter() - started
+    print(f"Loaded {inserted} documents into '{collection_name}' in {elapsed:.1f}s ({inserted / elapsed:.0f} rows/sec).")
+    return inserted
+
+
+def apply_delta(db, path, collection_name=COLLECTION_NAME, batch_size=5000):
+    """
+    Applies a build_catalog.py delta to the live collection with unordered bulk
+    writes keyed by name. Returns the number of operations.
+    """
+    collection = db[collection_name]
+    collection.create_index("name")
+    started = time.perf_counter()
+    operations = 0
+    with open(path, "r", encoding="utf-8") as f:
+        changes = (json.loads(line) for line in f if line.strip())
+        for batch in batches(changes, batch_size):
+            requests = [
+                ReplaceOne({"name": change["document"]["name"]}, change["document"], upsert=True)
+                if change["op"] == "upsert" else DeleteOne({"name": change["name"]})
+                for change in batch
+            ]
+            collection.bulk_write(requests, ordered=False)
+            operations += len(requests)
+    if operations:
+        bump_catalog_version(db, collection_name)
+    elapsed = time.perf_counter() - started
+    print(f"Applied {operations} changes to '{collection_name}' in {elapsed:.1f}s ({operations / max(elapsed, 1e-9):.0f} rows/sec).")
+    return operations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load the medications collection through a staging collection.")
+    parser.add_argument("--source", choices=sorted(SOURCES), default="catalog",
+                        help="catalog (build_catalog.py, with ingredients), embeddings (embed_catalog.py) or csv (names only)")
+    parser.add_argument("--input", default=None, help="defaults to catalog.jsonl or medication_embeddings.npy; required for csv")
+    parser.add_argument("--delta", default=None, help="apply a build_catalog.py delta in place instead of a full load")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    args = parser.parse_args(argv)
+
+    path = args.input or {"embeddings": "medication_embeddings.npy", "catalog": CATALOG_PATH}.get(args.source)
+    if path is None and not args.delta:
+        parser.error(f"--input is required for --source {args.source}")
+
+    client = connect()
+    if args.delta:
+        apply_delta(client[DB_NAME], args.delta, args.collection, args.batch_size)
+        return
+    if args.source == "csv":
+        print("Loading names only: the interaction precheck needs the ingredients of --source catalog.")
+    bulk_load(client[DB_NAME], SOURCES[args.source](path), args.collection, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Embeds the medication names for the hybrid matcher.
+
+Reads one name per row (first CSV column, or the "name" of each catalog.jsonl
+document) and writes, next to each other:
+  medication_embeddings.npy         (n, dim) normalized float32 or int8 matrix
+  medication_embeddings.names.txt   the name of each row, one per line
+  medication_embeddings.hashes.npy  content hash of each row (model + name)
+
+Names whose hash is already in the previous output are copied instead of re-encoded.
+New embeddings are checkpointed to medication_embeddings.partial/ every few batches,
+so an interrupted run picks up where it stopped.
+
+    python embed_catalog.py --input catalog.jsonl --batch-size 256 --processes 4
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+DEFAULT_OUTPUT = os.environ.get("EMBEDDINGS_PATH", "medication_embeddings.npy")
+DEFAULT_MODEL = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+INT8_SCALE = 127.0
+
+
+def read_names(path):
+    names = {}
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            # catalog.jsonl written by build_catalog.py
+            rows = ([json.loads(line)["name"]] for line in f if line.strip())
+        else:
+            rows = csv.reader(f)
+        for row in rows:
+            if row and row[0].strip():
+                names.setdefault(row[0].strip(), None)
+    return list(names)
+
+
+def content_hash(model_name, name):
+    return hashlib.blake2b(f"{model_name}\0{name}".encode("utf-8"), digest_size=16).digest()
+
+
+def hash_array(hashes):
+    # Stored as raw bytes: numpy's "S" dtype would strip trailing zero bytes.
+    return np.frombuffer(b"".join(hashes), dtype=np.uint8).reshape(-1, 16)
+
+
+def output_paths(output):
+    stem = os.path.splitext(output)[0]
+    return {
+        "matrix": output,
+        "names": stem + ".names.txt",
+        "hashes": stem + ".hashes.npy",
+        "partial": stem + ".partial",
+    }
+
+
+class EmbeddingPool:
+    """
+    Embeddings available for reuse, keyed by content hash: the rows of the previous
+    output and the chunks checkpointed by an interrupted run.
+    """
+
+    def __init__(self):
+        self.sources = []
+        self.rows = {}
+
+    def add(self, matrix, hashes):
+        source = len(self.sources)
+        self.sources.append(matrix)
+        for row, digest in enumerate(hashes):
+            self.rows[digest.tobytes()] = (source, row)
+
+    def __contains__(self, digest):
+        return digest in self.rows
+
+    def get(self, digest):
+        source, row = self.rows[digest]
+        vector = np.asarray(self.sources[source][row])
+        if vector.dtype == np.int8:
+            return vector.astype(np.float32) / INT8_SCALE
+        return vector
+
+
+def load_pool(paths, dtype):
+    pool = EmbeddingPool()
+    if os.path.exists(paths["matrix"]) and os.path.exists(paths["hashes"]):
+        previous = np.load(paths["matrix"], mmap_mode="r")
+        hashes = np.load(paths["hashes"])
+        # int8 rows would lose precision when rewritten as float32, so re-encode those.
+        if len(previous) == len(hashes) and (previous.dtype == np.float32 or dtype == "int8"):
+            pool.add(previous, hashes)
+    for hashes_path in sorted(glob.glob(os.path.join(paths["partial"], "chunk-*.hashes.npy"))):
+        chunk = hashes_path[:-len(".hashes.npy")] + ".npy"
+        pool.add(np.load(chunk, mmap_mode="r"), np.load(hashes_path))
+    return pool
+
+
+class Encoder:
+    def __init__(self, model_name, processes):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.pool = None
+        if processes > 1:
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * processes)
+
+    def encode(self, names, batch_size):
+        if self.pool is not None:
+            vectors = self.model.encode_multi_process(names, self.pool, batch_size=batch_size)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        else:
+            vectors = self.model.encode(names, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+
+
+def write_output(paths, names, hashes, pool, dtype):
+    dim = len(pool.get(hashes[0]))
+    tmp = {key: path + ".tmp" for key, path in paths.items() if key != "partial"}
+    matrix = np.lib.format.open_memmap(tmp["matrix"], mode="w+", dtype=np.int8 if dtype == "int8" else np.float32, shape=(len(names), dim))
+    for row, digest in enumerate(hashes):
+        vector = pool.get(digest)
+        if dtype == "int8":
+            vector = np.clip(np.round(vector * INT8_SCALE), -127, 127)
+        matrix[row] = vector
+    matrix.flush()
+    del matrix
+    with open(tmp["names"], "w", encoding="utf-8") as f:
+        f.writelines(name + "\n" for name in names)
+    with open(tmp["hashes"], "wb") as f:
+        np.save(f, hash_array(hashes))
+    # The matrix goes last: a reader seeing the new names with the old matrix
+    # notices the row count mismatch and retries on the next reload.
+    for key in ("hashes", "names", "matrix"):
+        os.replace(tmp[key], paths[key])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed medication names for the hybrid matcher.")
+    parser.add_argument("--input", default="catalog.jsonl")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--checkpoint-batches", type=int, default=20, help="batches encoded between checkpoints")
+    parser.add_argument("--processes", type=int, default=1, help="CPU worker processes used for encoding")
+    parser.add_argument("--dtype", choices=("float32", "int8"), default="float32")
+    args = parser.parse_args()
+
+    paths = output_paths(args.output)
+    names = read_names(args.input)
+    if not names:
+        print("No names to embed.")
+        return
+    hashes = [content_hash(args.model, name) for name in names]
+    pool = load_pool(paths, args.dtype)
+    pending = [(name, digest) for name, digest in zip(names, hashes) if digest not in pool]
+    print(f"{len(names)} names, {len(names) - len(pending)} already embedded, {len(pending)} to encode.")
+
+    if pending:
+        os.makedirs(paths["partial"], exist_ok=True)
+        chunk_size = args.batch_size * args.checkpoint_batches
+        chunk_id = len(glob.glob(os.path.join(paths["partial"], "chunk-*.hashes.npy")))
+        encoder = Encoder(args.model, args.processes)
+        started = time.perf_counter()
+        done = 0
+        try:
+            for start in range(0, len(pending), chunk_size):
+                chunk = pending[start:start + chunk_size]
+                vectors = encoder.encode([name for name, _ in chunk], args.batch_size)
+                chunk_hashes = hash_array([digest for _, digest in chunk])
+                base = os.path.join(paths["partial"], f"chunk-{chunk_id:05d}")
+                # Vectors first, hashes last: a chunk only counts once its hashes exist.
+                np.save(base + ".npy", vectors)
+                np.save(base + ".hashes.npy", chunk_hashes)
+                pool.add(vectors, chunk_hashes)
+                chunk_id += 1
+                done += len(chunk)
+                elapsed = time.perf_counter() - started
+                print(f"Encoded {done}/{len(pending)} names ({done / elapsed:.0f} names/sec)")
+        finally:
+            encoder.close()
+
+    write_output(paths, names, hashes, pool, args.dtype)
+    shutil.rmtree(paths["partial"], ignore_errors=True)
+    print(f"Wrote {len(names)} embeddings ({args.dtype}) to {paths['matrix']} and {paths['names']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+from fastapi.responses import StreamingResponse
+
+
+def _sse(data: Any, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def sse_events(tokens: AsyncIterator[str], on_complete: Optional[Callable[[dict], Awaitable[None]]] = None) -> AsyncIterator[str]:
+    """
+    Relays tokens as server-sent events: one `data: {"token": ...}` event per token, then an
+    `event: done` carrying the full {"generated_text": ...} (the non-streaming response body).
+    Errors after the stream has started are reported as an `event: error`.
+    """
+    parts = []
+    try:
+        async for token in tokens:
+            parts.append(token)
+            yield _sse({"token": token})
+    except Exception as e:
+        yield _sse({"detail": f"Failed to generate LLM response: {str(e) or type(e).__name__}"}, event="error")
+        return
+    result = {"generated_text": "".join(parts)}
+    if on_complete is not None:
+        await on_complete(result)
+    yield _sse(result, event="done")
+
+
+async def replay(result: Any) -> AsyncIterator[str]:
+    """
+    Token stream for an already complete (e.g. cached) generation.
+    """
+    text = result.get("generated_text", "") if isinstance(result, dict) else ""
+    if text:
+        yield text
+
+
+def sse_response(tokens: AsyncIterator[str], on_complete: Optional[Callable[[dict], Awaitable[None]]] = None) -> StreamingResponse:
+    return StreamingResponse(
+        sse_events(tokens, on_complete),
+        media_type="text/event-stream",
+        # Keep proxies (ngrok, nginx) from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def ndjson_as_completed(ready: Iterable[dict], pending: Iterable[Awaitable[dict]]) -> AsyncIterator[str]:
+    """
+    One JSON line per result: the ready ones first, then the pending ones in completion
+    order. They all run concurrently; if the client goes away, the unfinished ones are
+    cancelled.
+    """
+    for result in ready:
+        yield json.dumps(result) + "\n"
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in pending]
+    try:
+        remaining = set(tasks)
+        while remaining:
+            done, remaining = await asyncio.wait(remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result()) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _section(name: str, awaitable: Awaitable[dict]) -> dict:
+    return {"section": name, **(await awaitable)}
+
+
+def ndjson_sections(ready: Dict[str, dict], pending: Dict[str, Awaitable[dict]]) -> AsyncIterator[str]:
+    """
+    One JSON line per section, {"section": name, ...}, as in ndjson_as_completed.
+    """
+    return ndjson_as_completed(
+        ({"section": name, **result} for name, result in ready.items()),
+        (_section(name, awaitable) for name, awaitable in pending.items()),
+    )
+
+
+def ndjson_response(lines: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        lines,
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,92 @@
+import asyncio
+import socket
+
+import pytest
+
+import fda_client as fda_client_module
+from bench.fakes import FDAStubServer
+from fda_client import FDAClient, FDAError
+
+
+@pytest.fixture
+def stub():
+    server = FDAStubServer(["Advil", "Tylenol"], latency=0.05).start()
+    yield server
+    server.stop()
+
+
+def run(client: FDAClient, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def test_label_lookup(stub):
+    client = FDAClient(stub.url)
+    label = run(client, client.label_by_brand_name("Advil"))
+    assert label["openfda"]["brand_name"] == ["Advil"]
+    assert stub.requests == 1
+
+
+def test_not_found_is_cached_for_the_negative_ttl(stub, monkeypatch):
+    monkeypatch.setattr(fda_client_module, "FDA_NEGATIVE_CACHE_TTL_SECONDS", 0.3)
+    client = FDAClient(stub.url)
+
+    async def lookups():
+        first = await client.label_by_brand_name("Unknownol")
+        second = await client.label_by_brand_name("unknownol")
+        cached_requests = stub.requests
+        await asyncio.sleep(0.4)
+        third = await client.label_by_brand_name("Unknownol")
+        return first, second, cached_requests, third
+
+    first, second, cached_requests, third = run(client, lookups())
+    assert first is None and second is None and third is None
+    assert cached_requests == 1
+    assert stub.requests == 2
+
+
+def test_retries_server_errors(stub):
+    stub.errors.extend([503, 500])
+    client = FDAClient(stub.url, max_retries=2, backoff=0.01)
+    label = run(client, client.label_by_brand_name("Tylenol"))
+    assert label["openfda"]["brand_name"] == ["Tylenol"]
+    assert stub.requests == 3
+    assert client.upstream_errors == 2
+
+
+def test_server_errors_end_in_fda_error(stub):
+    stub.errors.extend([502, 503, 504])
+    client = FDAClient(stub.url, max_retries=2, backoff=0.01)
+    with pytest.raises(FDAError, match="HTTP 504"):
+        run(client, client.label_by_brand_name("Tylenol"))
+    assert stub.requests == 3
+    # Errors are not cached: the next lookup goes upstream again.
+    run(client, client.label_by_brand_name("Tylenol"))
+    assert stub.requests == 4
+
+
+def test_transport_errors_end_in_fda_error():
+    # A port nothing listens on: every attempt fails to connect.
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    client = FDAClient(f"http://127.0.0.1:{port}", max_retries=2, backoff=0.01)
+    with pytest.raises(FDAError, match="ConnectError"):
+        run(client, client.label_by_brand_name("Advil"))
+    assert client.upstream_calls == 3
+
+
+def test_concurrent_lookups_share_one_upstream_call(stub):
+    client = FDAClient(stub.url)
+
+    async def lookups():
+        return await asyncio.gather(*(client.label_by_brand_name(name) for name in ["Advil", "advil", "ADVIL"] * 5))
+
+    labels = run(client, lookups())
+    assert all(label == labels[0] for label in labels)
+    assert stub.requests == 1
+    assert client.stats()["coalesced"] == 14
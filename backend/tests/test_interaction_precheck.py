@@ -0,0 +1,102 @@
+import asyncio
+
+from interaction_precheck import TokenAutomaton, build_automaton, precheck_interactions, tokenize
+from medication_matcher import MedicationCatalog
+
+CATALOG = MedicationCatalog(
+    ["Advil", "Advil PM", "Coumadin", "Tylenol", "Aspirin", "Zyrtec"],
+    {"advil": ("IBUPROFEN",), "advil pm": ("IBUPROFEN", "DIPHENHYDRAMINE CITRATE"), "coumadin": ("WARFARIN SODIUM",), "tylenol": ("ACETAMINOPHEN",)},
+)
+AUTOMATON = build_automaton(CATALOG)
+
+
+def precheck(text, medications, ingredients=CATALOG.ingredients):
+    return precheck_interactions(text, medications, AUTOMATON, ingredients)
+
+
+def test_automaton_matches_on_word_boundaries():
+    automaton = TokenAutomaton([["advil"], ["advil", "pm"], ["pm"]])
+    found = {(automaton.patterns[pattern], end) for pattern, end in automaton.find_all(tokenize("Take Advil PM, not advilpm"))}
+    assert found == {(("advil",), 1), (("advil", "pm"), 2), (("pm",), 2)}
+
+
+def test_ingredient_hit():
+    text = "Aspirin may increase the anticoagulant effect of warfarin. Take with food."
+    result = precheck(text, ["Coumadin", "Tylenol"])
+    assert result.matched_medications == ["Coumadin"]
+    assert result.sentences == ["Aspirin may increase the anticoagulant effect of warfarin."]
+
+
+def test_brand_inside_longer_product_name():
+    text = "Do not use with Advil or other NSAIDs. Drink water."
+    result = precheck(text, ["Advil PM", "Tylenol"])
+    assert result.matched_medications == ["Advil PM"]
+    assert result.sentences == ["Do not use with Advil or other NSAIDs."]
+
+
+def test_no_medications_or_no_text():
+    assert precheck("Aspirin may increase the effect of warfarin.", []).matched_medications == []
+    assert precheck("", ["Coumadin"]).matched_medications == []
+
+
+def test_no_match_when_every_medication_has_ingredients():
+    result = precheck("Aspirin may increase the effect of warfarin.", ["Tylenol", "Advil"])
+    assert result.matched_medications == []
+
+
+def test_medication_without_ingredient_data_falls_back_to_full_text():
+    text = "Aspirin may increase the effect of warfarin. Ask a doctor."
+    # Zyrtec has no ingredient data, so a generic name in the text could still be it.
+    result = precheck(text, ["Tylenol", "Zyrtec"])
+    assert result.matched_medications == ["Tylenol", "Zyrtec"]
+    assert result.sentences == ["Aspirin may increase the effect of warfarin.", "Ask a doctor."]
+    # Names-only catalog: Coumadin against a warfarin sentence must reach the LLM.
+    assert precheck(text, ["Coumadin"], ingredients={}).matched_medications == ["Coumadin"]
+
+
+CLASS_ONLY = "Drugs that increase bleeding risk: NSAIDs, antiplatelet agents, and SSRIs. Monitor closely."
+
+
+def test_interaction_prompt_keeps_class_only_interactions(monkeypatch):
+    import app
+    monkeypatch.setattr(app, "INTERACTION_PRECHECK", False)
+    label = {"drug_interactions": [CLASS_ONLY]}
+    prompt = asyncio.run(app.build_interaction_prompt(["Advil", "Zoloft"], "Coumadin", label))
+    assert CLASS_ONLY in prompt
+    assert "Advil, Zoloft" in prompt
+    # Nothing to check: no interaction text, or no current medications.
+    assert asyncio.run(app.build_interaction_prompt(["Advil"], "Coumadin", {"drug_interactions": []})) is None
+    assert asyncio.run(app.build_interaction_prompt(["Advil"], "Coumadin", None)) is None
+    assert asyncio.run(app.build_interaction_prompt([], "Coumadin", label)) is None
+
+
+def test_precheck_misses_class_only_interactions():
+    # Why INTERACTION_PRECHECK is off by default.
+    catalog = MedicationCatalog(["Advil", "Zoloft"], {"advil": ("IBUPROFEN",), "zoloft": ("SERTRALINE HYDROCHLORIDE",)})
+    result = precheck_interactions(CLASS_ONLY, ["Advil", "Zoloft"], build_automaton(catalog), catalog.ingredients)
+    assert result.matched_medications == []
+
+
+def test_batch_sends_class_only_interactions_to_the_llm(monkeypatch):
+    import app
+    monkeypatch.setattr(app, "INTERACTION_PRECHECK", False)
+    prompts = []
+
+    async def generate(prompt, *args):
+        prompts.append(prompt)
+        return {"generated_text": "- Advil: bleeding risk"}
+
+    monkeypatch.setattr(app.prompt_batcher, "generate", generate)
+    batch = app.InteractionBatch(user_id="u", medications=["Coumadin"])
+
+    async def check(medications, label):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(label)
+        return await app.batch_interaction(medications, "Coumadin", future, {}, batch)
+
+    result = asyncio.run(check(["Advil", "Zoloft"], {"drug_interactions": [CLASS_ONLY]}))
+    assert result["hits"] == ["Advil", "Zoloft"]
+    assert result["generated_text"] == "- Advil: bleeding risk"
+    assert CLASS_ONLY in prompts[0]
+    assert asyncio.run(check(["Advil"], None)) == {"checked": ["Advil"], "hits": [], "generated_text": ""}
+    assert len(prompts) == 1
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from interaction_precheck import split_sentences
+from label_compaction import LABEL_SECTIONS, compact_label, count_tokens
+
+BOILERPLATE = "Keep out of reach of children. In case of overdose, get medical help right away."
+
+
+def label(**sections):
+    return {field: [text] for field, text in sections.items()}
+
+
+def long_label():
+    return label(
+        purpose="Pain reliever and fever reducer.",
+        active_ingredient="Ibuprofen 200 mg.",
+        do_not_use="Do not use right before or after heart surgery.",
+        warnings=" ".join(f"Allergy alert {i}: ibuprofen may cause a severe allergic reaction." for i in range(40)) + " " + BOILERPLATE,
+        dosage_and_administration="Adults: take 1 tablet every 4 to 6 hours.",
+        ask_doctor=BOILERPLATE + " Ask a doctor before use if you have stomach problems.",
+    )
+
+
+def sentence_positions(text, sentences):
+    return [text.index(sentence) for sentence in sentences]
+
+
+@pytest.mark.parametrize("budget", [10, 40, 100, 300])
+def test_output_stays_within_budget(budget):
+    compacted = compact_label(long_label(), "adult", False, budget)
+    assert compacted.tokens <= budget
+    assert compacted.tokens == count_tokens([compacted.text])[0]
+    assert compacted.original_tokens > budget
+
+
+def test_random_labels_stay_within_budget():
+    rng = random.Random(0)
+    words = "take tablet doctor pain stomach bleeding child adult pregnant hours water dose".split()
+    for _ in range(50):
+        sections = {
+            field: ". ".join(" ".join(rng.choice(words) for _ in range(rng.randint(1, 12))) for _ in range(rng.randint(0, 6)))
+            for field, _, _ in LABEL_SECTIONS
+        }
+        for budget in (5, 20, 80):
+            assert compact_label(label(**sections), "adult", False, budget).tokens <= budget
+
+
+def test_do_not_use_and_dosage_survive_repeated_warnings():
+    text = compact_label(long_label(), "adult", False, 100).text
+    assert "Do not use: Do not use right before or after heart surgery." in text
+    assert "Dosage: Adults: take 1 tablet every 4 to 6 hours." in text
+    assert "Purpose: Pain reliever and fever reducer." in text
+    # Most of the repeated warnings are dropped to make room.
+    assert 0 < text.count("Allergy alert") < 40
+
+
+def test_kept_sentences_stay_in_label_order():
+    sections = long_label()
+    text = compact_label(sections, "adult", False, 100).text
+    # Every sentence of the label, section by section in LABEL_SECTIONS order.
+    in_label_order = [sentence for field, _, _ in LABEL_SECTIONS for sentence in split_sentences(" ".join(sections.get(field, [])))]
+    kept = [sentence for sentence in dict.fromkeys(in_label_order) if sentence in text]
+    assert len(kept) < len(set(in_label_order))
+    assert sentence_positions(text, kept) == sorted(sentence_positions(text, kept))
+
+
+def test_duplicate_boilerplate_is_emitted_once():
+    compacted = compact_label(long_label(), "adult", False, budget=0)
+    assert compacted.text.count("Keep out of reach of children.") == 1
+    assert compacted.text.count("In case of overdose, get medical help right away.") == 1
+    assert "Ask Doctor: Ask a doctor before use if you have stomach problems." in compacted.text
+    assert compacted.tokens < compacted.original_tokens
+
+
+def test_pregnancy_sentences_are_kept_for_pregnant_users():
+    sections = long_label()
+    sections["pregnancy_or_breast_feeding"] = ["If pregnant or breast-feeding, ask a health professional before use."]
+    assert "ask a health professional" in compact_label(sections, "adult", True, 60).text
+    assert "ask a health professional" not in compact_label(sections, "adult", False, 60).text
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+from rapidfuzz import fuzz, process
+
+from medication_matcher import MedicationCatalog, MedicationIndex, best_match, find_closest_medications_batch
+
+_SYLLABLES = ["ad", "vil", "ty", "le", "nol", "zo", "loft", "cou", "ma", "din", "ami", "pro", "fen", "ox", "cin", "tra", "zep", "lor", "xa", "pam"]
+_SUFFIXES = ["", "", " PM", " Extra Strength", " Cold & Flu", " XR", " 24 Hour"]
+
+
+def synthetic_names(count, seed=0):
+    rng = random.Random(seed)
+    names = {}
+    while len(names) < count:
+        stem = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        name = stem + rng.choice(_SUFFIXES)
+        names.setdefault(name.lower(), name)
+    return list(names.values())
+
+
+def ocr_queries(names, count, seed=0):
+    """
+    Catalog names as OCR would read them: upper-cased, truncated, with typos and package text.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        name = rng.choice(names)
+        variant = rng.randrange(5)
+        if variant == 0:
+            query = name.upper()
+        elif variant == 1:
+            query = name[:rng.randint(1, len(name))]
+        elif variant == 2:
+            pos = rng.randrange(len(name))
+            query = name[:pos] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[pos + 1:]
+        elif variant == 3:
+            query = f"{name} {rng.choice(['TABLETS', '200 mg', 'Pain Reliever'])}"
+        else:
+            query = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(1, 20)))
+        queries.append(query)
+    return queries
+
+
+def extract(names, query, k):
+    return [match for match, score, index in process.extract(query, names, scorer=fuzz.ratio, limit=k)]
+
+
+@pytest.fixture(scope="module")
+def names():
+    # Duplicated stems and suffixes make many tied scores.
+    return synthetic_names(3000)
+
+
+@pytest.fixture(scope="module")
+def index(names):
+    return MedicationIndex(MedicationCatalog(names))
+
+
+@pytest.mark.parametrize("k", [1, 3, 10])
+def test_search_many_matches_exhaustive_extract(names, index, k):
+    queries = ocr_queries(names, 200, seed=k)
+    results = index.search_many([(query, k) for query in queries])
+    for query, result in zip(queries, results):
+        assert result == extract(names, query, k), query
+
+
+def test_search_many_mixed_k_in_one_batch(names, index):
+    queries = [(query, k) for k, query in enumerate(ocr_queries(names, 60, seed=7), start=1)]
+    for (query, k), result in zip(queries, index.search_many(queries)):
+        assert result == extract(names, query, k), query
+
+
+def test_search_many_edge_cases(names, index):
+    small = MedicationIndex(MedicationCatalog(names[:5]))
+    assert small.search_many([("advil", 10)]) == [extract(names[:5], "advil", 10)]
+    assert index.search_many([("advil", 0), ("", 2)]) == [[], extract(names, "", 2)]
+    assert MedicationIndex(MedicationCatalog([])).search_many([("advil", 3)]) == [[]]
+
+
+def test_find_closest_medications_batch_merges_prefix_queries(names, index):
+    for query in ocr_queries(names, 100, seed=3):
+        words = query.split() or [query]
+        while len(words) < 3:
+            words.append(words[-1])
+        prefixes = [(words[0], 3), (" ".join(words[:2]), 2), (" ".join(words[:3]), 1)]
+        expected = list(dict.fromkeys(name for prefix, k in prefixes for name in extract(names, prefix, k)))
+        assert find_closest_medications_batch(prefixes, index, exhaustive=False) == expected, query
+        assert find_closest_medications_batch(prefixes, index, exhaustive=True) == expected, query
+
+
+@pytest.mark.parametrize("ocr, expected", [
+    ("Advil PM", "Advil PM"),
+    ("Advil PM Caplets", "Advil PM"),
+    ("Tylenol PM Extra Strength", "Tylenol PM Extra Strength"),
+    ("Tylenol 500 mg", "Tylenol"),
+    ("Advl", "Advil"),
+])
+def test_scan_resolves_the_whole_ocr_text(names, monkeypatch, ocr, expected):
+    import asyncio
+
+    import app
+    catalog = names[:500] + ["Advil", "Advil PM", "Tylenol", "Tylenol PM", "Tylenol PM Extra Strength"]
+    index = MedicationIndex(MedicationCatalog(catalog))
+
+    async def get():
+        return index
+
+    monkeypatch.setattr(app.catalog_cache, "get", get)
+    candidates = asyncio.run(app.match_medications(ocr, 1))
+    assert best_match([ocr, *app.prefix_queries(ocr)], candidates) == expected
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import pytest
+
+import app
+import sagemaker_client
+from generation_cache import GenerationCache
+from sagemaker_client import stream_response
+from sagemaker_fake import FakeSageMakerRuntime
+
+TEXT = '- Take 1 tablet "with food".\n- Ask a doctor if pregnant.'
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    runtime = FakeSageMakerRuntime(latency=0, token_latency=0, text=TEXT)
+    monkeypatch.setattr(sagemaker_client, "sagemaker_runtime", runtime)
+    # The semaphore is bound to the event loop of the test that created it.
+    monkeypatch.setattr(sagemaker_client, "_semaphore", None)
+    return runtime
+
+
+def parse_sse(chunks):
+    events = []
+    for chunk in "".join(chunks).split("\n\n"):
+        if chunk:
+            lines = dict(line.split(": ", 1) for line in chunk.split("\n"))
+            events.append((lines.get("event"), json.loads(lines["data"])))
+    return events
+
+
+def test_stream_response_reassembles_split_lines(fake):
+    tokens = list(stream_response("prompt", max_new_tokens=256))
+    assert tokens == [word + " " for word in TEXT.split(" ")]
+    assert "".join(tokens) == TEXT + " "
+    assert list(stream_response("prompt", max_new_tokens=3)) == tokens[:3]
+
+
+def test_parse_stream_line():
+    assert sagemaker_client._parse_stream_line(b'data:{"token": {"text": " Take", "special": false}}') == " Take"
+    assert sagemaker_client._parse_stream_line(b'data:{"token": {"text": "</s>", "special": true}}') is None
+    assert sagemaker_client._parse_stream_line(b'{"outputs": [" Take"]}') == " Take"
+    assert sagemaker_client._parse_stream_line(b"data:") is None
+    assert sagemaker_client._parse_stream_line(b'data:{"token": {"te') is None
+
+
+def test_streamed_translation_fills_the_generation_cache(fake, monkeypatch):
+    cache = GenerationCache()
+    monkeypatch.setattr(app, "generation_cache", cache)
+    _, key = app.prepare_translation("Purpose: Pain reliever", 550, 0.9, 0.6, "30", "female", False)
+
+    async def stream():
+        response = await app.stream_translation("Purpose: Pain reliever", age="30", gender="female")
+        chunks = [chunk async for chunk in response.body_iterator]
+        return chunks, await cache.lookup(key)
+
+    chunks, cached = asyncio.run(stream())
+    events = parse_sse(chunks)
+    tokens = [data["token"] for event, data in events if event is None]
+    assert "".join(tokens) == TEXT + " "
+    assert events[-1] == ("done", {"generated_text": TEXT + " "})
+    assert cached == {"generated_text": TEXT + " "}
+    assert fake.invocations == 1
+
+    async def replayed():
+        response = await app.stream_translation("Purpose: Pain reliever", age="30", gender="female")
+        return [chunk async for chunk in response.body_iterator]
+
+    # The second request is replayed from the cache without calling the endpoint.
+    assert parse_sse(asyncio.run(replayed()))[-1] == ("done", {"generated_text": TEXT + " "})
+    assert fake.invocations == 1
@@ -0,0 +1,89 @@
+import os
+from typing import Any, Dict, Iterable, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from cache_utils import MISSING, SingleFlight, TTLCache
+from instrumentation import span
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+# Kept short: the write paths of this worker invalidate entries, but other workers don't.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+# The only fields the LLM endpoints read.
+PROFILE_PROJECTION = {"_id": 0, "age": 1, "gender": 1, "pregnant": 1, "medications": 1}
+
+
+class UserProfileCache:
+    """
+    Short-lived cache of the user fields used to personalize LLM requests, so that
+    back-to-back calls for the same scan read the user from Mongo once.
+
+    Returned profiles are shared between requests and must not be mutated.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.cache = TTLCache(maxsize, ttl)
+        self._single_flight = SingleFlight()
+        # Bumped by every invalidation, so a read that raced with a write is not cached.
+        self._generation = 0
+        self.invalidations = 0
+
+    async def get(self, collection: AsyncIOMotorCollection, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the user's profile fields, or None if the user does not exist.
+        """
+        key = str(ObjectId(user_id))
+        profile = self.cache.get(key)
+        if profile is not MISSING:
+            return profile
+        return await self._single_flight.do(key, lambda: self._load(collection, key))
+
+    async def get_many(self, collection: AsyncIOMotorCollection, user_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Profiles of several users, keyed by id (None for unknown users), with the ones
+        not cached read in a single query.
+        """
+        keys = {user_id: str(ObjectId(user_id)) for user_id in user_ids}
+        profiles: Dict[str, Optional[Dict[str, Any]]] = {}
+        missing = []
+        for key in set(keys.values()):
+            profile = self.cache.get(key)
+            if profile is MISSING:
+                missing.append(key)
+            else:
+                profiles[key] = profile
+        if missing:
+            generation = self._generation
+            cursor = collection.find({"_id": {"$in": [ObjectId(key) for key in missing]}}, {**PROFILE_PROJECTION, "_id": 1})
+            with span("mongo_user_lookup"):
+                async for profile in cursor:
+                    key = str(profile.pop("_id"))
+                    profiles[key] = profile
+                    if generation == self._generation:
+                        self.cache.set(key, profile)
+        return {user_id: profiles.get(key) for user_id, key in keys.items()}
+
+    async def _load(self, collection: AsyncIOMotorCollection, key: str) -> Optional[Dict[str, Any]]:
+        generation = self._generation
+        with span("mongo_user_lookup"):
+            profile = await collection.find_one({"_id": ObjectId(key)}, PROFILE_PROJECTION)
+        # Unknown users are not cached; the id may be created later.
+        if profile is not None and generation == self._generation:
+            self.cache.set(key, profile)
+        return profile
+
+    def invalidate(self, user_id: str):
+        self._generation += 1
+        self.invalidations += 1
+        self.cache.pop(str(ObjectId(user_id)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "coalesced": self._single_flight.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+
+user_cache = UserProfileCache()